@@ -0,0 +1,176 @@
+"""グラフ・承認率一覧・クロス集計用の集計（件数・承認件数・取扱高合計）。
+
+データセットごとに AggregationCube を一度だけ作り、集計対象の各列をコード化しておく。
+フィルタ後の集計はマスクで絞ったコードに対する np.bincount だけで求め、
+結果はフィルタ状態（マスクのハッシュ）ごとにメモ化する。
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+
+# グラフ表示する項目（タイトル, 列）
+chart_cols = [
+    ("性別", "性別"),
+    ("年齢", "年齢"),
+    ("年収", "年収帯"),
+    ("都道府県", "都道府県"),
+    ("利用目的", "利用目的"),
+    ("同借希望額", "借入希望額帯"),
+    ("家族構成", "家族構成"),
+    ("子供数", "子供数"),
+    ("住宅ローン返済月額", "住宅ローン帯"),
+    ("勤務状況", "勤務状況"),
+    ("勤続年数", "勤続年数帯"),
+    ("他社借入件数", "他社借入件数"),
+    ("媒体名", "媒体名"),
+    ("承認区分", "承認区分")
+]
+
+# クロス集計で選べる項目
+pivot_candidates = [
+    "性別", "年齢", "年収帯", "都道府県", "利用目的", "借入希望額帯",
+    "家族構成", "子供数", "住宅ローン帯", "勤務状況", "勤続年数帯",
+    "他社借入件数", "媒体名", "承認区分"
+]
+
+# 承認件数として数える承認区分
+APPROVED_LABEL = "承認"
+
+# 承認率の内訳に選べる項目
+approval_candidates = ["媒体名", "カテゴリ"] + [c for c in pivot_candidates if c not in ("媒体名", "承認区分")]
+
+# 組み合わせ数がこれ以下なら全組み合わせの bincount、超えたら np.unique で詰めてから集計
+_DENSE_LIMIT = 10_000_000
+
+_cube_cache = LRUCache(max_entries=4, max_bytes=2 * 1024 ** 3, name="cube")
+
+
+def mask_key(mask: np.ndarray) -> str:
+    """フィルタ結果（ブールマスク）を表すキー"""
+    return hashlib.blake2b(np.packbits(mask).tobytes(), digest_size=16).hexdigest()
+
+
+class AggregationCube:
+    """集計対象列のコード・取扱高・承認フラグを保持し、マスクごとの集計を返す"""
+
+    def __init__(self, df: pd.DataFrame, dims: list, value_col: str = "取扱高", approval_col: str = "承認区分"):
+        df = df.loc[:, ~pd.Index(df.columns).duplicated()]
+        self._n = len(df)
+        self._codes = {}   # 列 -> コード（欠損は -1）
+        self._labels = {}  # 列 -> コードに対応する値
+        for dim in dict.fromkeys(dims):
+            if dim not in df.columns:
+                continue
+            s = df[dim]
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                codes, labels = s.cat.codes.to_numpy(), s.cat.categories
+            else:
+                codes, labels = pd.factorize(s, sort=True)
+            self._codes[dim] = codes.astype(np.int32)
+            self._labels[dim] = pd.Index(labels)
+
+        if value_col in df.columns:
+            self._values = pd.to_numeric(df[value_col], errors="coerce").fillna(0).to_numpy(dtype="float64")
+        else:
+            self._values = np.zeros(self._n)
+        if approval_col in df.columns:
+            self._approved = (df[approval_col] == APPROVED_LABEL).to_numpy(dtype=bool, na_value=False)
+        else:
+            self._approved = np.zeros(self._n, dtype=bool)
+        # 名前付きにしてプロセス全体のメモリ上限の対象にする
+        self._memo = LRUCache(max_entries=256, max_bytes=256 * 1024 ** 2, name="cube_memo")
+
+    @property
+    def nbytes(self) -> int:
+        # 集計結果のキャッシュ（_memo）は自身で数えるため含めない
+        return self._values.nbytes + self._approved.nbytes + sum(codes.nbytes for codes in self._codes.values())
+
+    @property
+    def dims(self) -> list:
+        return list(self._codes)
+
+    def _decode(self, dim: str, codes: np.ndarray):
+        labels = self._labels[dim]
+        if (codes < 0).any():
+            # 欠損を含む場合は object 配列で NaN を持たせる（整数ラベルを float にしない）
+            values = np.append(labels.to_numpy(dtype=object), np.nan)
+            return values[codes]
+        return labels.take(codes)
+
+    def labels(self, dim: str) -> pd.Index:
+        """dim のコードに対応する値"""
+        return self._labels[dim]
+
+    def group_codes(self, dims: list, mask: np.ndarray, key: str = None):
+        """dims の値の組み合わせごとのコード（列ごとの配列、欠損は -1）と 件数・承認件数・取扱高
+
+        出現した組み合わせのみをコード順（欠損が先頭）に返す。key には mask_key(mask) を渡せる。
+        """
+        memo_key = ("codes", key or mask_key(mask), tuple(dims))
+        cached = self._memo.get(memo_key)
+        if cached is not None:
+            return cached
+
+        sizes = [len(self._labels[dim]) + 1 for dim in dims]
+        combined = np.zeros(int(mask.sum()), dtype=np.int64)
+        for dim, size in zip(dims, sizes):
+            combined *= size
+            combined += self._codes[dim][mask] + 1
+        weights = self._values[mask]
+        approved = self._approved[mask]
+
+        total = int(np.prod(sizes))
+        if total <= _DENSE_LIMIT:
+            counts = np.bincount(combined, minlength=total)
+            sums = np.bincount(combined, weights=weights, minlength=total)
+            approvals = np.bincount(combined[approved], minlength=total)
+            present = np.flatnonzero(counts)
+            counts, sums, approvals = counts[present], sums[present], approvals[present]
+        else:
+            present, inverse = np.unique(combined, return_inverse=True)
+            counts = np.bincount(inverse)
+            sums = np.bincount(inverse, weights=weights)
+            approvals = np.bincount(inverse[approved], minlength=len(present))
+
+        codes = {}
+        for dim, size in reversed(list(zip(dims, sizes))):
+            codes[dim] = present % size - 1
+            present = present // size
+        result = ({dim: codes[dim] for dim in dims}, counts, approvals, sums)
+        return self._memo.put(memo_key, result)
+
+    def group(self, dims: list, mask: np.ndarray, key: str = None) -> pd.DataFrame:
+        """dims の値の組み合わせごとの 件数・承認件数・取扱高（出現した組み合わせのみ、欠損もグループとして残す）
+
+        行はコード順（欠損が先頭、以降は値の昇順）に並ぶ。key には mask_key(mask) を渡せる。
+        """
+        memo_key = (key or mask_key(mask), tuple(dims))
+        cached = self._memo.get(memo_key)
+        if cached is not None:
+            return cached
+
+        codes, counts, approvals, sums = self.group_codes(dims, mask, key)
+        result = pd.DataFrame({dim: self._decode(dim, codes[dim]) for dim in dims})
+        result["件数"] = counts
+        result["承認件数"] = approvals
+        result["取扱高"] = sums
+        return self._memo.put(memo_key, result)
+
+    def summary(self, dim: str, mask: np.ndarray, key: str = None) -> pd.DataFrame:
+        """dim の値ごとの 件数・承認件数・取扱高（欠損と未出現の値を除き、値の昇順）"""
+        grouped = self.group([dim], mask, key)
+        return grouped.dropna(subset=[dim]).set_index(dim)
+
+    def summaries(self, dims: list, mask: np.ndarray, key: str = None) -> dict:
+        """複数項目の summary をまとめて返す"""
+        key = key or mask_key(mask)
+        return {dim: self.summary(dim, mask, key) for dim in dims if dim in self._codes}
+
+
+def load_cube(key, df: pd.DataFrame) -> AggregationCube:
+    """key（データセット・マスタの組）ごとに AggregationCube を作って使い回す"""
+    dims = [col for _, col in chart_cols] + pivot_candidates + approval_candidates
+    return _cube_cache.get_or_compute(key, lambda: AggregationCube(df, dims))
@@ -1,97 +1,112 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 from datetime import date
 
+from aggregate import approval_candidates, load_cube, mask_key, pivot_candidates
+from approval import approval_rates
+from binning import add_bin_columns
+from cache import cache_stats
+from charts import chart_figures, create_trend_chart
+from export import cached_export, export_formats
+from filters import filter_cols, load_filter_engine
+from ingest import load_uploaded_workbooks
+from master import attach_master, load_master_index
+from paging import page_count, page_frame, page_sizes, sorted_positions
+from pivot import additive_metrics, build_pivot, pivot_export_frame, pivot_metrics
+from profiling import PROFILE_LOG_PATH, Profiler, stage, start_profiler
+from store import load_catalog, load_months, save_dataset
+from trend import add_trend_columns, load_rollup, trend_freqs, trend_metrics
+
 # ----------------------------------------------------
 # ページ設定
 # ----------------------------------------------------
 st.set_page_config(page_title="後方数値データ分析", layout="wide")
 st.title("📊 後方数値データ分析ダッシュボード")
 
-# ----------------------------------------------------
-# カテゴリ順序定義
-# ----------------------------------------------------
-category_orders = {
-    "年収帯": ['0-499', '500-999', '1000以上'],
-    "借入希望額帯": ['0', '1-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90-99', '100-199', '200-299', '300以上'],
-    "住宅ローン帯": ['0', '1-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90-99', '100以上'],
-    "勤続年数帯": ['0', '1-3', '4-9', '10-20', '21以上']
-}
+# 処理時間・メモリの計測（サイドバー末尾のチェックボックスでオン、前回の再実行の値を使う）
+profiler = start_profiler(st.session_state.get("profiling", False), st.session_state)
 
 # サイドバー：ファイルアップロード
 st.sidebar.header("ファイルアップロード")
-uploaded_data = st.sidebar.file_uploader("後方数値データをアップロード", type=["xlsx"])
+uploaded_files = st.sidebar.file_uploader("後方数値データをアップロード（複数可）", type=["xlsx"], accept_multiple_files=True)
+
+# サイドバー：保存済みデータ（アップロードが無いときに月を選んで読み込む）
+catalog = load_catalog()
+selected_months = []
+if not uploaded_files and catalog:
+    st.sidebar.header("保存済みデータ")
+    dataset_ids = list(catalog)
+    selected_datasets = st.sidebar.multiselect(
+        "データセットを選択", dataset_ids, default=dataset_ids[-1:],
+        format_func=lambda i: f"{catalog[i]['name']}（{catalog[i]['saved_at']}）"
+    )
+    month_options = [(i, m) for i in selected_datasets for m in catalog[i]["months"]]
+    selected_months = st.sidebar.multiselect(
+        "申込月を選択", month_options, default=month_options,
+        format_func=lambda o: f"{o[1]}（{catalog[o[0]]['name']}）"
+    )
 
 # マスタファイル読み込み（GitHub固定）
 master_path = "媒体コードマスタ.xlsx"
-master = pd.read_excel(master_path)
-master.columns = [str(c).strip().replace('\u3000', '').replace('\xa0', '') for c in master.columns]
-master.rename(columns={"会社名": "媒体名"}, inplace=True)
-
-id_vars = [col for col in master.columns if col in ["媒体名", "カテゴリ"]]
-code_cols = [col for col in master.columns if col not in id_vars]
-master_long = master.melt(id_vars=id_vars, value_vars=code_cols,
-                          var_name="コード列", value_name="媒体コード").dropna(subset=["媒体コード"])
+master_index = load_master_index(master_path)
+if not master_index.conflicts.empty:
+    with st.sidebar.expander(f"⚠️ 媒体コードマスタの重複コード（{master_index.conflicts['媒体コード'].nunique()}件）"):
+        st.write("同じ媒体コードに異なる媒体名/カテゴリが登録されています。先に出現した行を採用しています。")
+        st.dataframe(master_index.conflicts, use_container_width=True)
 
 # 後方数値データ読み込み
-if uploaded_data is not None:
-    # 後方数値データ読み込み
-    df = pd.read_excel(uploaded_data)
-    df.columns = [str(c).strip().replace('\u3000', '').replace('\xa0', '') for c in df.columns]
-
-    # 性別整形（例：'xxx_男性' → '男性'）
-    if '性別' in df.columns:
-        df['性別'] = df['性別'].astype(str).str.extract(r'_(男性|女性)', expand=False).fillna(df['性別'])
-
-    # 数値列変換（存在チェック付き）
-    numeric_cols = [
-        '年齢', '年収', '同借希望額', '住宅ローン返済月額', '勤続年数',
-        '他社借入件数', '取扱金額_申込当月', '取扱金額_申込翌月末', '取扱金額_申込翌々月末'
-    ]
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # 申込日 → datetime
-    if '申込日' in df.columns:
-        df['申込日'] = pd.to_datetime(df['申込日'], errors='coerce')
-
-    # 取扱高計算（不足列は0で補完）
-    amount_cols = ['取扱金額_申込当月', '取扱金額_申込翌月末', '取扱金額_申込翌々月末']
-    for c in amount_cols:
-        if c not in df.columns:
-            df[c] = 0
-    df['取扱高'] = df[amount_cols].sum(axis=1)
-
-    # 承認区分のNULL処理
-    if '承認区分' in df.columns:
-        df['承認区分'] = df['承認区分'].fillna('NULL')
-    else:
-        df['承認区分'] = 'NULL'
-
-    # マスタと突合（媒体コードがある前提）
-    if '媒体コード' in df.columns and not master_long.empty:
-        merged_df = df.merge(master_long, on="媒体コード", how="left")
-    else:
-        merged_df = df.copy()
-        if '媒体名' not in merged_df.columns:
-            merged_df['媒体名'] = pd.NA
-        if 'カテゴリ' not in merged_df.columns:
-            merged_df['カテゴリ'] = pd.NA
+profiler.begin("load")
+df = None
+if uploaded_files:
+    # 後方数値データ読み込み・整形（ファイル内容ハッシュでキャッシュ、複数ファイルは並列に読み込み）
+    ingest_result = load_uploaded_workbooks([(f.name, f.getvalue()) for f in uploaded_files])
+    for name, reason in ingest_result.skipped.items():
+        st.sidebar.warning(f"{name}: {reason}")
+    if ingest_result.duplicates:
+        basis = "・".join(ingest_result.key_cols) if len(ingest_result.key_cols) == 2 else "全列が一致"
+        st.sidebar.caption(f"ファイル間で重複する {ingest_result.duplicates:,} 行を除きました（判定: {basis}）")
+    df = ingest_result.df
+    data_key = ingest_result.key
+    # 次回から再アップロード不要になるよう申込月ごとに保存（保存済みならスキップ）
+    if df is not None:
+        try:
+            save_dataset(df, data_key[:16], "、".join(f.name for f in uploaded_files))
+        except Exception as e:
+            # 保存できなくても（ディスク・Parquet 変換の失敗など）分析は続けられる
+            st.sidebar.warning(f"データの保存に失敗しました: {e}")
+elif selected_months:
+    df = load_months(selected_months)
+
+if df is not None:
+    # マスタと突合し、フィルタ用の索引を作成（データセット・マスタが変わるまで使い回す）
+    dataset_key = data_key if uploaded_files else tuple(selected_months)
+    # 年齢・年収など数値列の帯もここで一度だけ作る（定義は binning.bin_specs）
+    engine_key = (dataset_key, master_index.key)
+    def build_filter_frame():
+        with stage("merge"):
+            merged = attach_master(df, master_index)
+        with stage("bin"):
+            return add_bin_columns(merged)
+
+    profiler.begin("index")
+    engine = load_filter_engine(engine_key, build_filter_frame, base=df)
+    cube = load_cube(engine_key, engine.df)
+    # 時系列トレンド用の 日 × 媒体名 × カテゴリ の集計も一度だけ作る
+    rollup = load_rollup(engine_key, engine.df)
 
     # -------------------------
     # ✅ フィルタUI（日付・カテゴリなど）
     # -------------------------
+    profiler.begin("filter")
     st.sidebar.header("フィルタ設定")
 
     # 日付範囲のデフォルト（NaT除去）
-    if '申込日' in merged_df.columns:
-        date_series = merged_df['申込日'].dropna()
-        if not date_series.empty:
-            default_start = date_series.min().date()
-            default_end = date_series.max().date()
+    date_mask = None
+    if engine.has_dates:
+        bounds = engine.date_bounds()
+        if bounds is not None:
+            default_start, default_end = bounds
         else:
             today = date.today()
             default_start, default_end = today, today
@@ -102,351 +117,232 @@ if uploaded_data is not None:
         else:
             start_date = date_range
             end_date = date_range
-
-        filtered_df = merged_df[
-            (merged_df['申込日'] >= pd.to_datetime(start_date)) &
-            (merged_df['申込日'] <= pd.to_datetime(end_date))
-        ].copy()
+        date_mask = engine.date_mask(start_date, end_date)
     else:
         st.sidebar.info("データに『申込日』列がないため、日付フィルタは無効です。")
-        filtered_df = merged_df.copy()
-
-    # カテゴリフィルタ
-    category_options = ["ALL"] + sorted(filtered_df["カテゴリ"].dropna().unique().tolist())
-    selected_categories = st.sidebar.multiselect("カテゴリを選択", category_options, default=["ALL"])
-    if "ALL" not in selected_categories:
-        filtered_df = filtered_df[filtered_df["カテゴリ"].isin(selected_categories)]
-
-    # 媒体名フィルタ
-    company_options = ["ALL"] + sorted(filtered_df["媒体名"].dropna().unique().tolist())
-    selected_companies = st.sidebar.multiselect("媒体名を選択", company_options, default=["ALL"])
-    if "ALL" not in selected_companies:
-        filtered_df = filtered_df[filtered_df["媒体名"].isin(selected_companies)]
-
-    # 承認区分フィルタ
-    approval_options = ["ALL"] + sorted(filtered_df["承認区分"].dropna().unique().tolist())
-    selected_approval = st.sidebar.multiselect("承認区分を選択", approval_options, default=["ALL"])
-    if "ALL" not in selected_approval:
-        filtered_df = filtered_df[filtered_df["承認区分"].isin(selected_approval)]
-
-    # 性別フィルタ
-    gender_options = ["ALL"] + sorted(filtered_df["性別"].dropna().unique().tolist())
-    selected_genders = st.sidebar.multiselect("性別を選択", gender_options, default=["ALL"])
-    if "ALL" not in selected_genders:
-        filtered_df = filtered_df[filtered_df["性別"].isin(selected_genders)]
-
-    st.write(f"件数: {len(filtered_df):,}件")
 
-    # -------------------------
-    # ✅ データ整形（年齢・年収帯など）
-    # -------------------------
-    def group_age_10(x):
-        if pd.isna(x): return "不明"
-        try:
-            xi = int(float(x))
-        except Exception:
-            return "不明"
-        if xi < 10: return "0-9"
-        elif xi < 20: return "10-19"
-        elif xi < 30: return "20-29"
-        elif xi < 40: return "30-39"
-        elif xi < 50: return "40-49"
-        elif xi < 60: return "50-59"
-        elif xi < 70: return "60-69"
-        elif xi < 80: return "70-79"
-        elif xi < 90: return "80-89"
-        else: return "90以上"
-
-    def group_income(x):
-        if pd.isna(x): return "不明"
-        return "0-499" if x < 500 else ("500-999" if x < 1000 else "1000以上")
-
-    def group_loan(x):
-        if pd.isna(x): return "不明"
-        if x == 0: return "0"
-        elif x < 10: return "1-9"
-        elif x < 20: return "10-19"
-        elif x < 30: return "20-29"
-        elif x < 40: return "30-39"
-        elif x < 50: return "40-49"
-        elif x < 60: return "50-59"
-        elif x < 70: return "60-69"
-        elif x < 80: return "70-79"
-        elif x < 90: return "80-89"
-        elif x < 100: return "90-99"
-        elif x < 200: return "100-199"
-        elif x < 300: return "200-299"
-        else: return "300以上"
-
-    def group_mortgage(x):
-        if pd.isna(x): return "不明"
-        if x == 0: return "0"
-        elif x < 10: return "1-9"
-        elif x < 20: return "10-19"
-        elif x < 30: return "20-29"
-        elif x < 40: return "30-39"
-        elif x < 50: return "40-49"
-        elif x < 60: return "50-59"
-        elif x < 70: return "60-69"
-        elif x < 80: return "70-79"
-        elif x < 90: return "80-89"
-        elif x < 100: return "90-99"
-        else: return "100以上"
-
-    def group_years(x):
-        if pd.isna(x): return "不明"
-        if x == 0: return "0"
-        elif x <= 3: return "1-3"
-        elif x <= 9: return "4-9"
-        elif x <= 20: return "10-20"
-        else: return "21以上"
-
-    if '年齢' in filtered_df.columns:
-        filtered_df['年齢'] = filtered_df['年齢'].apply(group_age_10)
-    if '年収' in filtered_df.columns:
-        filtered_df['年収帯'] = filtered_df['年収'].apply(group_income)
-    if '同借希望額' in filtered_df.columns:
-        filtered_df['借入希望額帯'] = filtered_df['同借希望額'].apply(group_loan)
-    if '住宅ローン返済月額' in filtered_df.columns:
-        filtered_df['住宅ローン帯'] = filtered_df['住宅ローン返済月額'].apply(group_mortgage)
-    if '勤続年数' in filtered_df.columns:
-        filtered_df['勤続年数帯'] = filtered_df['勤続年数'].apply(group_years)
+    # カテゴリ・媒体名・承認区分・性別フィルタ（選択肢は前段のフィルタで残った値）
+    masks = [date_mask]
+    filter_selections = {}
+    for col in filter_cols:
+        if not engine.has_filter(col):
+            continue
+        options = ["ALL"] + engine.options(col, engine.combine(masks))
+        selected = st.sidebar.multiselect(f"{col}を選択", options, default=["ALL"])
+        if "ALL" not in selected:
+            masks.append(engine.isin_mask(col, selected))
+            filter_selections[col] = selected
+    mask = engine.combine(masks)
+
+    n_filtered = int(mask.sum())
+    st.write(f"件数: {n_filtered:,}件")
+    # 集計結果のメモ化キー（フィルタ状態）
+    state_key = mask_key(mask)
+
+    # ダウンロード（ファイルはボタンが押されたときに作り、キーごとにキャッシュ）
+    export_format = st.sidebar.selectbox("ダウンロード形式", list(export_formats), index=0)
+
+    def export_with_stage(key, make_frame, fmt, profiling=profiler.enabled):
+        # data はボタンが押されたときに再実行の計測（finish）より後に別スレッドで呼ばれるため、
+        # 再実行とは別の Profiler で計測してログに1行追記する
+        export_profiler = Profiler(enabled=profiling)
+        with export_profiler.stage("export"):
+            data = cached_export(key, make_frame, fmt)
+        export_profiler.finish(export=fmt, export_bytes=len(data))
+        return data
+
+    def lazy_download_button(label, make_frame, file_stem, key):
+        ext, mime = export_formats[export_format]
+        st.download_button(
+            label=label,
+            data=lambda: export_with_stage(key, make_frame, export_format),
+            file_name=f"{file_stem}.{ext}",
+            mime=mime
+        )
 
     # -------------------------
     # ✅ フィルタ後データテーブル＋CSV
     # -------------------------
+    profiler.begin("table")
     st.subheader("📋 フィルタ後データ一覧")
+    all_cols = engine.df.columns.tolist()
     display_cols = []
-    if "媒体コード" in filtered_df.columns:
+    if "媒体コード" in all_cols:
         display_cols.append("媒体コード")
-    if "媒体名" in filtered_df.columns:
+    if "媒体名" in all_cols:
         display_cols.append("媒体名")
     # 先頭に媒体コード/媒体名を置いて残りを続ける
-    display_cols += [col for col in filtered_df.columns if col not in display_cols]
-    st.dataframe(filtered_df[display_cols], use_container_width=True)
-
-    csv = filtered_df.to_csv(index=False).encode('utf-8-sig')
-    st.download_button(
-        label="フィルタ後データCSVをダウンロード",
-        data=csv,
-        file_name="filtered_data.csv",
-        mime="text/csv"
+    display_cols += [col for col in all_cols if col not in display_cols]
+
+    # 並べ替え・列選択はサーバー側で行い、表示中のページだけを送る
+    with st.expander("表示列"):
+        shown_cols = st.multiselect("表示する列", display_cols, default=display_cols)
+    table_controls = st.columns(4)
+    sort_col = table_controls[0].selectbox("並べ替え", ["（なし）"] + display_cols, index=0)
+    ascending = table_controls[1].selectbox("順序", ["昇順", "降順"], index=0) == "昇順"
+    page_size = table_controls[2].selectbox("表示件数", page_sizes, index=1)
+    n_pages = page_count(n_filtered, page_size)
+    page = table_controls[3].number_input(f"ページ（全{n_pages:,}）", min_value=1, max_value=n_pages, value=1)
+
+    positions = sorted_positions(
+        engine.df, mask, None if sort_col == "（なし）" else sort_col, ascending,
+        key=(engine_key, state_key)
+    )
+    st.dataframe(page_frame(engine.df, positions, page, page_size, shown_cols or display_cols),
+                 use_container_width=True)
+    first_row = min((page - 1) * page_size + 1, n_filtered)
+    last_row = min(page * page_size, n_filtered)
+    st.caption(f"{first_row:,}〜{last_row:,}件目を表示（全{n_filtered:,}件）")
+
+    lazy_download_button(
+        "フィルタ後データをダウンロード",
+        lambda: engine.materialize(mask),
+        "filtered_data",
+        (engine_key, state_key, "filtered_data")
     )
 
     # -------------------------
     # ✅ 承認率一覧＋CSVエクスポート
     # -------------------------
-    if "媒体名" in filtered_df.columns:
+    profiler.begin("summary")
+    approval_dims = [c for c in approval_candidates if c in cube.dims]
+    if "媒体名" in approval_dims:
         st.subheader("📌 媒体別 承認率一覧（降順）")
+        breakdown = st.multiselect("内訳項目", approval_dims, default=["媒体名"])
+        sort_key = st.radio("並び順", ["承認率(%)", "承認率下限(%)"], horizontal=True,
+                            help="承認率下限は95%信頼区間（Wilson）の下限で、件数の少ない媒体を過大評価しにくい並び順です。")
+        breakdown = breakdown or ["媒体名"]
         approval_summary = (
-            filtered_df.groupby("媒体名", dropna=False)
-            .apply(lambda x: pd.Series({
-                "件数": len(x),
-                "承認件数": (x["承認区分"] == "承認").sum(),
-                "承認率(%)": round(((x["承認区分"] == "承認").sum() / len(x) * 100), 2) if len(x) else 0.0
-            }))
-            .reset_index()
-            .sort_values(by="承認率(%)", ascending=False)
+            approval_rates(cube.group(breakdown, mask, state_key), breakdown)
+            .sort_values(by=sort_key, ascending=False)
         )
         st.dataframe(approval_summary, use_container_width=True)
 
-        csv_approval = approval_summary.to_csv(index=False).encode('utf-8-sig')
-        st.download_button(
-            label="承認率一覧CSVをダウンロード",
-            data=csv_approval,
-            file_name="approval_summary.csv",
-            mime="text/csv"
+        lazy_download_button(
+            "承認率一覧をダウンロード",
+            lambda frame=approval_summary: frame,
+            "approval_summary",
+            (engine_key, state_key, "approval_summary", tuple(breakdown), sort_key)
         )
 
     # -------------------------
     # ✅ グラフ表示（件数＋取扱高のみ）
     # -------------------------
+    profiler.begin("charts")
     st.subheader("📈 項目別インタラクティブグラフ")
-    chart_cols = [
-        ("性別", "性別"),
-        ("年齢", "年齢"),
-        ("年収", "年収帯"),
-        ("都道府県", "都道府県"),
-        ("利用目的", "利用目的"),
-        ("同借希望額", "借入希望額帯"),
-        ("家族構成", "家族構成"),
-        ("子供数", "子供数"),
-        ("住宅ローン返済月額", "住宅ローン帯"),
-        ("勤務状況", "勤務状況"),
-        ("勤続年数", "勤続年数帯"),
-        ("他社借入件数", "他社借入件数"),
-        ("媒体名", "媒体名"),
-        ("承認区分", "承認区分")
-    ]
-
-    def create_dual_axis_grouped_chart(df, category_col, title):
-        # カラム存在＆非空チェック
-        if category_col not in df.columns or df[category_col].dropna().shape[0] == 0:
-            return go.Figure()
-
-        # カテゴリ順序対応
-        if category_col in category_orders:
-            ordered_categories = category_orders[category_col]
-            count_data = df[category_col].value_counts().reindex(ordered_categories).fillna(0)
-            sum_data = df.groupby(category_col)['取扱高'].sum().reindex(ordered_categories).fillna(0)
-        else:
-            count_data = df[category_col].value_counts().sort_index()
-            sum_data = df.groupby(category_col)['取扱高'].sum().reindex(count_data.index).fillna(0)
-
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            x=count_data.index,
-            y=count_data.values,
-            name="件数",
-            marker_color="skyblue",
-            offsetgroup=0,
-            yaxis="y"
-        ))
-        fig.add_trace(go.Bar(
-            x=sum_data.index,
-            y=sum_data.values,
-            name="取扱高（円）",
-            marker_color="orange",
-            offsetgroup=1,
-            yaxis="y2"
-        ))
-        fig.update_layout(
-            title=f"{title}（件数＋取扱高）",
-            xaxis=dict(title=category_col),
-            yaxis=dict(title="件数", side="left"),
-            yaxis2=dict(title="取扱高（円）", overlaying="y", side="right"),
-            barmode="group",
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-        )
-        return fig
 
-    for title, col in chart_cols:
-        if col in filtered_df.columns and filtered_df[col].dropna().shape[0] > 0:
-            fig = create_dual_axis_grouped_chart(filtered_df, col, title)
-            st.plotly_chart(fig, use_container_width=True)
+    for title, col, fig in chart_figures(cube, mask, state_key):
+        st.plotly_chart(fig, use_container_width=True)
+
+    # -------------------------
+    # ✅ 時系列トレンド（日次集計から週・月次を作る）
+    # -------------------------
+    if date_mask is not None and len(rollup):
+        profiler.begin("trend")
+        st.subheader("📉 時系列トレンド")
+        trend_controls = st.columns(4)
+        trend_freq = trend_controls[0].radio("集計単位", list(trend_freqs), index=1, horizontal=True)
+        trend_metric = trend_controls[1].selectbox("指標", trend_metrics, index=0)
+        trend_by = trend_controls[2].selectbox("内訳", ["（なし）"] + rollup.dims, index=0)
+        trend_window = trend_controls[3].number_input("移動平均（期間数、0で無し）", min_value=0, max_value=52, value=0)
+        trend_by = None if trend_by == "（なし）" else trend_by
+
+        ignored = [col for col in filter_selections if col not in rollup.dims]
+        if ignored:
+            st.caption(f"時系列トレンドには {'・'.join(ignored)} のフィルタは反映されません。")
+        trend_series = add_trend_columns(
+            rollup.series(start_date, end_date, trend_freqs[trend_freq], trend_by,
+                          {col: v for col, v in filter_selections.items() if col in rollup.dims}),
+            trend_metric, trend_window, trend_by
+        )
+        st.plotly_chart(create_trend_chart(trend_series, trend_metric, trend_by, trend_window),
+                        use_container_width=True)
+        with st.expander("推移の集計表（前期差・前期比）"):
+            st.dataframe(trend_series, use_container_width=True, hide_index=True)
+        lazy_download_button(
+            "推移の集計表をダウンロード",
+            lambda frame=trend_series: frame,
+            "trend",
+            (engine_key, "trend", start_date, end_date, trend_freq, trend_metric, trend_by, trend_window,
+             tuple((col, tuple(v)) for col, v in filter_selections.items()))
+        )
 
     # -------------------------
     # ✅ クロス集計（ピボット）
     # -------------------------
+    profiler.begin("pivot")
     st.subheader("🧮 クロス集計（ピボット）")
 
-    df_pivot_base = filtered_df.copy()
-    # 重複列名の除去
-    df_pivot_base = df_pivot_base.loc[:, ~pd.Index(df_pivot_base.columns).duplicated()]
-    # MultiIndexのフラット化（保険）
-    df_pivot_base.columns = [
-        "_".join(map(str, c)) if isinstance(c, tuple) else str(c)
-        for c in df_pivot_base.columns
-    ]
-
-    # 取扱高が無い場合でも動くように補完
-    if "取扱高" not in df_pivot_base.columns:
-        df_pivot_base["取扱高"] = 0
-
-    # リスト/タプルが紛れているセルを 1次元化し、カテゴリを文字列化
-    def to_1d_str(s: pd.Series) -> pd.Series:
-        return s.apply(lambda v: v[0] if isinstance(v, (list, tuple)) else v).astype(str)
-
-    pivot_candidates = [
-        "性別", "年齢", "年収帯", "都道府県", "利用目的", "借入希望額帯",
-        "家族構成", "子供数", "住宅ローン帯", "勤務状況", "勤続年数帯",
-        "他社借入件数", "媒体名", "承認区分"
-    ]
-    available = [c for c in pivot_candidates if c in df_pivot_base.columns]
+    available = [c for c in pivot_candidates if c in cube.dims]
 
     if not available:
         st.warning("ピボット可能な項目が見つかりません。")
     else:
-        row_dim = st.selectbox("行（Row）", available, index=0)
-        col_dim = st.selectbox("列（Column）", ["（なし）"] + available, index=1 if len(available) > 1 else 0)
-        value_metric = st.selectbox("値（Value）", ["件数", "取扱高合計"], index=0)
-        show_percent = st.checkbox("行方向の構成比（%）を表示", value=False)
-
-        # 選択列を 1次元の文字列に揃える
-        df_pivot_base[row_dim] = to_1d_str(df_pivot_base[row_dim])
-        if col_dim != "（なし）":
-            df_pivot_base[col_dim] = to_1d_str(df_pivot_base[col_dim])
+        # 行・列は複数選べる（上から順に入れ子になり、小計を挟む）
+        row_dims = st.multiselect("行（Row）", available, default=available[:1])
+        col_dims = st.multiselect("列（Column）", [c for c in available if c not in row_dims],
+                                  default=[c for c in available[1:2] if c not in row_dims])
+        value_metric = st.selectbox("値（Value）", pivot_metrics, index=0)
+        pivot_options = st.columns(2)
+        show_subtotals = pivot_options[0].checkbox("小計を表示", value=True)
+        show_percent = pivot_options[1].checkbox("行方向の構成比（%）を表示", value=False,
+                                                 disabled=value_metric not in additive_metrics)
 
         try:
-            if value_metric == "件数":
-                if col_dim == "（なし）":
-                    # 単純集計（行のみ）
-                    result = (
-                        df_pivot_base.groupby(row_dim, dropna=False)
-                        .size()
-                        .reset_index(name="件数")
-                        .sort_values(by=row_dim)
-                    )
-                    if show_percent:
-                        total = result["件数"].sum()
-                        result["構成比(%)"] = (result["件数"] / total * 100).round(2) if total else 0.0
-                    st.dataframe(result, use_container_width=True)
-                    csv_bytes = result.to_csv(index=False).encode("utf-8-sig")
-                else:
-                    # 行 × 列のクロス集計（件数）
-                    ct = pd.crosstab(
-                        df_pivot_base[row_dim],
-                        df_pivot_base[col_dim],
-                        dropna=False
-                    )
-                    if show_percent:
-                        denom = ct.sum(axis=1).replace(0, pd.NA)
-                        ct_percent = (ct.div(denom, axis=0) * 100).round(2).fillna(0)
-                        st.write("行方向の構成比（%）")
-                        st.dataframe(ct_percent, use_container_width=True)
-                        csv_bytes = ct_percent.reset_index().to_csv(index=False).encode("utf-8-sig")
-                    else:
-                        st.dataframe(ct, use_container_width=True)
-                        csv_bytes = ct.reset_index().to_csv(index=False).encode("utf-8-sig")
-
-            else:  # 取扱高合計
-                df_pivot_base["取扱高合計"] = pd.to_numeric(df_pivot_base["取扱高"], errors="coerce").fillna(0)
-                if col_dim == "（なし）":
-                    result = (
-                        df_pivot_base.groupby(row_dim, dropna=False)["取扱高合計"]
-                        .sum()
-                        .reset_index()
-                        .sort_values(by=row_dim)
-                    )
-                    if show_percent:
-                        total = result["取扱高合計"].sum()
-                        result["構成比(%)"] = (result["取扱高合計"] / total * 100).round(2) if total else 0.0
-                    st.dataframe(result, use_container_width=True)
-                    csv_bytes = result.to_csv(index=False).encode("utf-8-sig")
-                else:
-                    pv = pd.pivot_table(
-                        df_pivot_base,
-                        index=[row_dim],
-                        columns=[col_dim],
-                        values="取扱高合計",
-                        aggfunc="sum",
-                        fill_value=0,
-                        dropna=False,
-                        sort=True
-                    )
-                    if show_percent:
-                        row_sum = pv.sum(axis=1).replace(0, pd.NA)
-                        pv_percent = (pv.div(row_sum, axis=0) * 100).round(2).fillna(0)
-                        st.write("行方向の構成比（%）")
-                        st.dataframe(pv_percent, use_container_width=True)
-                        csv_bytes = pv_percent.reset_index().to_csv(index=False).encode("utf-8-sig")
-                    else:
-                        st.dataframe(pv, use_container_width=True)
-                        csv_bytes = pv.reset_index().to_csv(index=False).encode("utf-8-sig")
-
-            st.download_button("クロス集計CSVをダウンロード", csv_bytes, "pivot.csv", "text/csv")
+            pv = build_pivot(cube, row_dims or available[:1], col_dims, value_metric, mask, state_key,
+                             subtotals=show_subtotals, percent=show_percent, key=engine_key)
+            if show_percent and value_metric in additive_metrics:
+                st.write("行方向の構成比（%）")
+            st.dataframe(pv, use_container_width=True)
+
+            lazy_download_button(
+                "クロス集計をダウンロード",
+                lambda frame=pv: pivot_export_frame(frame),
+                "pivot",
+                (engine_key, state_key, "pivot", tuple(row_dims), tuple(col_dims), value_metric,
+                 show_subtotals, show_percent)
+            )
 
         except Exception as e:
             with st.expander("🔎 デバッグ情報（開いて確認）"):
                 st.write("エラー:", str(e))
-                st.write("列一覧:", df_pivot_base.columns.tolist())
-                dup_counts = pd.Series(df_pivot_base.columns).value_counts()
+                st.write("列一覧:", engine.df.columns.tolist())
+                dup_counts = pd.Series(engine.df.columns).value_counts()
                 st.write("重複列名（出現回数）:", dup_counts[dup_counts > 1] if (dup_counts > 1).any() else "なし")
-                st.write("選択 Row/Column:", row_dim, col_dim)
+                st.write("選択 Row/Column:", row_dims, col_dims)
             st.error("クロス集計でエラーが発生しました。")
 
 else:
     # アップロードが未実施の案内
-    st.info("Excelファイル（後方数値データ）をアップロードしてください。")
-
-
+    if catalog:
+        st.info("Excelファイル（後方数値データ）をアップロードするか、保存済みデータの申込月を選択してください。")
+    else:
+        st.info("Excelファイル（後方数値データ）をアップロードしてください。")
+
+# -------------------------
+# ⏱ 処理時間・メモリ（計測オン時のみ）
+# -------------------------
+st.sidebar.header("パフォーマンス計測")
+st.sidebar.checkbox("処理時間・メモリを計測", key="profiling",
+                    help=f"段階ごとの所要時間と tracemalloc のピークを表示し、{PROFILE_LOG_PATH} に追記します（計測中は処理が遅くなります）。"
+                         "メモリはプロセス全体の値で、同時に計測中の他セッションの確保も含みます。")
+if profiler.enabled:
+    total_seconds = profiler.total_seconds
+    records = profiler.finish(rows=0 if df is None else len(df),
+                              filtered_rows=n_filtered if df is not None else 0)
+    with st.sidebar.expander(f"⏱ 今回の再実行（計 {total_seconds:.2f} 秒）", expanded=True):
+        breakdown_df = pd.DataFrame(records, columns=["stage", "seconds", "peak_bytes"])
+        breakdown_df["peak_bytes"] = (breakdown_df["peak_bytes"] / 1024 ** 2).round(1)
+        st.dataframe(
+            breakdown_df.rename(columns={"stage": "段階", "seconds": "秒", "peak_bytes": "ピークメモリ(MB・プロセス全体)"}),
+            use_container_width=True, hide_index=True
+        )
+        # 全セッションで共有しているキャッシュの状況
+        st.write("共有キャッシュ（全セッション共通）")
+        stats_df = pd.DataFrame(cache_stats(), columns=["name", "entries", "bytes", "hits", "misses"])
+        stats_df["bytes"] = (stats_df["bytes"] / 1024 ** 2).round(1)
+        st.dataframe(
+            stats_df.rename(columns={"name": "キャッシュ", "entries": "件数", "bytes": "メモリ(MB)",
+                                     "hits": "ヒット", "misses": "ミス"}),
+            use_container_width=True, hide_index=True
+        )
@@ -0,0 +1,37 @@
+"""承認率の集計（任意の項目の組み合わせ別・Wilson 信頼区間付き）。
+
+入力は AggregationCube.group() の結果（項目の組み合わせごとの 件数・承認件数）で、
+行データを走査し直さずに数千件の媒体でもすぐに並べ替えられる。
+"""
+import numpy as np
+import pandas as pd
+
+# 信頼区間の z 値（95%）
+DEFAULT_Z = 1.96
+
+
+def wilson_interval(successes, totals, z: float = DEFAULT_Z):
+    """二項比率の Wilson スコア信頼区間（下限, 上限）。totals が 0 の要素は NaN"""
+    k = np.asarray(successes, dtype="float64")
+    n = np.asarray(totals, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = k / n
+        z2 = z * z
+        denom = 1 + z2 / n
+        center = (p + z2 / (2 * n)) / denom
+        half = z * np.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / denom
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+
+def approval_rates(grouped: pd.DataFrame, dims: list, z: float = DEFAULT_Z) -> pd.DataFrame:
+    """dims の組み合わせごとの 件数・承認件数・承認率(%) と信頼区間（欠損もグループとして残す）"""
+    result = (
+        grouped.groupby(dims, dropna=False, sort=True)
+        .agg(件数=("件数", "sum"), 承認件数=("承認件数", "sum"))
+        .reset_index()
+    )
+    lower, upper = wilson_interval(result["承認件数"], result["件数"], z)
+    result["承認率(%)"] = (result["承認件数"] / result["件数"] * 100).round(2)
+    result["承認率下限(%)"] = np.round(lower * 100, 2)
+    result["承認率上限(%)"] = np.round(upper * 100, 2)
+    return result
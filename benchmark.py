@@ -0,0 +1,125 @@
+"""Streamlit を使わない処理段階のベンチマーク（合成データで行数を変えて計測）。
+
+段階は ingest（Excel読み込み・整形）・merge（マスタ突合）・bin（区分け）・
+filter（索引作成・絞り込み）・aggregate（グラフ・承認率の集計）・pivot・export で、
+画面と同じ関数を呼ぶ。各段階の秒数・行/秒・tracemalloc のピークを表示し、
+--log を指定すると JSONL に追記する（profiling と同じ形式）。
+
+Excel は1シート約105万行までのため、それを超える行数と --excel-max-rows を超える行数では
+ingest を整形（clean_uploaded_frame）だけの計測にする。
+
+使い方:
+    python benchmark.py --sizes 10000 100000 1000000 5000000
+"""
+import argparse
+import sys
+
+import pandas as pd
+
+from aggregate import AggregationCube, chart_cols, mask_key, pivot_candidates
+from approval import approval_rates
+from binning import add_bin_columns
+from export import export_bytes, export_formats
+from filters import FilterEngine
+from ingest import clean_uploaded_frame, read_workbook
+from master import attach_master, load_master_index
+from pivot import build_pivot
+from profiling import Profiler
+from synthetic import DEFAULT_MASTER_PATH, EXCEL_MAX_ROWS, make_frame, master_codes, workbook_bytes
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+EXCEL_BENCH_MAX_ROWS = 100_000
+
+
+def run_pipeline(raw: pd.DataFrame, master_index, profiler: Profiler, excel: bytes = None):
+    """画面と同じ順に各段階を実行する（profiler の段階として記録）"""
+    with profiler.stage("ingest"):
+        df = read_workbook(excel) if excel is not None else clean_uploaded_frame(raw.copy())
+
+    with profiler.stage("merge"):
+        merged = attach_master(df, master_index)
+    with profiler.stage("bin"):
+        binned = add_bin_columns(merged)
+
+    with profiler.stage("filter"):
+        with profiler.stage("index"):
+            engine = FilterEngine(binned)
+        with profiler.stage("mask"):
+            masks = []
+            bounds = engine.date_bounds()
+            if bounds is not None:
+                start, end = bounds
+                masks.append(engine.date_mask(start + (end - start) / 4, end))
+            for col in ["カテゴリ", "承認区分"]:
+                if engine.has_filter(col):
+                    options = engine.options(col, engine.combine(masks))
+                    masks.append(engine.isin_mask(col, options[: max(1, len(options) // 2)]))
+            mask = engine.combine(masks)
+            key = mask_key(mask)
+
+    with profiler.stage("aggregate"):
+        with profiler.stage("cube"):
+            cube = AggregationCube(binned, [col for _, col in chart_cols] + pivot_candidates + ["カテゴリ"])
+        with profiler.stage("summaries"):
+            cube.summaries([col for _, col in chart_cols], mask, key)
+        with profiler.stage("approval"):
+            approval_rates(cube.group(["媒体名"], mask, key), ["媒体名"])
+
+    with profiler.stage("pivot"):
+        # 画面の既定より重い 行2項目 × 列2項目 の小計付き（件数・承認率）
+        for metric in ["件数", "承認率(%)"]:
+            build_pivot(cube, ["年収帯", "性別"], ["都道府県", "承認区分"], metric, mask, key, subtotals=True)
+
+    with profiler.stage("export"):
+        filtered = engine.materialize(mask)
+        for fmt in export_formats:
+            with profiler.stage(export_formats[fmt][0]):
+                export_bytes(filtered, fmt)
+    return int(mask.sum())
+
+
+def benchmark(sizes: list, master_path: str = DEFAULT_MASTER_PATH, excel_max_rows: int = EXCEL_BENCH_MAX_ROWS,
+              trace_memory: bool = True, log_path: str = None, seed: int = 0) -> pd.DataFrame:
+    """行数ごとにパイプラインを実行し、段階ごとの 秒・行/秒・ピークメモリ を返す"""
+    master_index = load_master_index(master_path)
+    codes = master_codes(master_path)
+    rows = []
+    for n_rows in sizes:
+        raw = make_frame(n_rows, codes, seed=seed)
+        excel = workbook_bytes(raw) if n_rows <= min(excel_max_rows, EXCEL_MAX_ROWS) else None
+        profiler = Profiler(trace_memory=trace_memory)
+        filtered_rows = run_pipeline(raw, master_index, profiler, excel)
+        records = profiler.finish(log_path=log_path, rows=n_rows, filtered_rows=filtered_rows,
+                                  ingest="excel" if excel is not None else "clean_only")
+        for record in records:
+            rows.append({
+                "rows": n_rows,
+                "stage": record["stage"],
+                "seconds": record["seconds"],
+                "rows_per_sec": round(n_rows / record["seconds"]) if record["seconds"] else None,
+                "peak_mb": round(record["peak_bytes"] / 1024 ** 2, 1) if trace_memory else None,
+            })
+        del raw, excel
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成データで処理段階ごとの所要時間・メモリを計測します")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="行数（複数指定可）")
+    parser.add_argument("--master", default=DEFAULT_MASTER_PATH, help="媒体コードマスタのExcelファイル")
+    parser.add_argument("--excel-max-rows", type=int, default=EXCEL_BENCH_MAX_ROWS,
+                        help="この行数までは Excel 読み込みも ingest に含める")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc を使わない（時間だけ計測）")
+    parser.add_argument("--log", default=None, help="結果を追記する JSONL ファイル")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    args = parser.parse_args(argv)
+
+    result = benchmark(args.sizes, args.master, args.excel_max_rows, not args.no_memory, args.log, args.seed)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(result.to_string(index=False))
+    print("※ tracemalloc 有効時は処理が遅くなるため、時間の比較には --no-memory も併用してください",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
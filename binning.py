@@ -0,0 +1,87 @@
+"""数値列の帯（年齢・年収帯など）への区分け。
+
+区分けの境界とラベルは bin_specs に一か所で定義し、グラフのカテゴリ順序
+（category_orders）もここから作る。区分けは NumPy の一括比較で行い、
+結果は「不明」を含む順序付き category 型になる。
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+UNKNOWN_LABEL = "不明"
+
+
+class BinSpec(NamedTuple):
+    source: str                        # 元の数値列
+    target: str                        # 区分け結果の列
+    edges: list                        # 区分けの境界（昇順）
+    labels: list                       # 境界で区切った各区間のラベル（len(edges) + 1 個）
+    zero_label: Optional[str] = None   # 0 ちょうどを別区分にする場合のラベル
+    right: bool = False                # True: 境界値を下側の区間に含める（x <= edge）
+    truncate: bool = False             # True: 小数を切り捨ててから区分けする
+    chart_order: bool = True           # グラフのカテゴリ順序に使うか
+
+    @property
+    def categories(self) -> list:
+        zero = [self.zero_label] if self.zero_label is not None else []
+        return zero + list(self.labels)
+
+
+bin_specs = [
+    BinSpec("年齢", "年齢",
+            edges=[10, 20, 30, 40, 50, 60, 70, 80, 90],
+            labels=['0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90以上'],
+            truncate=True, chart_order=False),
+    BinSpec("年収", "年収帯",
+            edges=[500, 1000],
+            labels=['0-499', '500-999', '1000以上']),
+    BinSpec("同借希望額", "借入希望額帯",
+            edges=[10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 200, 300],
+            labels=['1-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90-99',
+                    '100-199', '200-299', '300以上'],
+            zero_label='0'),
+    BinSpec("住宅ローン返済月額", "住宅ローン帯",
+            edges=[10, 20, 30, 40, 50, 60, 70, 80, 90, 100],
+            labels=['1-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90-99',
+                    '100以上'],
+            zero_label='0'),
+    BinSpec("勤続年数", "勤続年数帯",
+            edges=[3, 9, 20],
+            labels=['1-3', '4-9', '10-20', '21以上'],
+            zero_label='0', right=True),
+]
+
+# カテゴリ順序定義（グラフ用）
+category_orders = {spec.target: spec.categories for spec in bin_specs if spec.chart_order}
+
+
+def bin_series(values: pd.Series, spec: BinSpec) -> pd.Series:
+    """数値の Series を spec に従って区分けし、順序付き category 型で返す"""
+    x = pd.to_numeric(values, errors='coerce').to_numpy(dtype="float64", na_value=np.nan)
+    unknown = np.isnan(x)
+    if spec.truncate:
+        # int() 変換できない値（±inf）は不明扱い
+        unknown |= np.isinf(x)
+        x = np.trunc(x)
+
+    # 境界は高々十数個なので、二分探索より境界ごとの比較を足し合わせる方が速い
+    codes = np.zeros(len(x), dtype=np.int8)
+    for edge in spec.edges:
+        codes += (x > edge) if spec.right else (x >= edge)
+    if spec.zero_label is not None:
+        codes += 1
+        codes[x == 0] = 0
+    codes[unknown] = len(spec.categories)
+
+    dtype = pd.CategoricalDtype(spec.categories + [UNKNOWN_LABEL], ordered=True)
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype, validate=False),
+                     index=values.index, name=spec.target)
+
+
+def add_bin_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """df に帯の列を追加する（元の列が無い帯はスキップ）"""
+    for spec in bin_specs:
+        if spec.source in df.columns:
+            df[spec.target] = bin_series(df[spec.source], spec)
+    return df
@@ -0,0 +1,306 @@
+"""件数上限・メモリ上限付きの LRU キャッシュ（プロセス内の全セッションで共有）。
+
+Streamlit は操作のたびにスクリプトを再実行するため、重い前処理の結果を
+モジュール変数としてプロセス内に保持し、再実行時に使い回す。キーはファイル内容の
+ハッシュやフィルタ状態なので、同じデータを見ている別セッションも同じ結果を使う。
+
+- 同じキーを複数セッションが同時に求めた場合、計算するのは1つだけで他は結果を待つ
+- 名前付きのキャッシュは合計が SHARED_CACHE_MAX_BYTES を超えると、全体で最も古いものから追い出す
+  （データセットごとのオブジェクトが内部に持つキャッシュも名前を付けて数える）
+- spill=True のキャッシュは CACHE_SPILL_DIR を設定すると、追い出した値をディスクに退避し、
+  次に必要になったときに読み戻す（サーバー再起動後も使える）
+"""
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+import pandas as pd
+
+# 名前付きキャッシュ全体のメモリ上限
+SHARED_CACHE_MAX_BYTES = int(os.environ.get("SHARED_CACHE_MAX_BYTES", 8 * 1024 ** 3))
+
+# ディスク退避先（未設定なら退避しない）と退避ファイル全体の上限
+CACHE_SPILL_DIR = os.environ.get("CACHE_SPILL_DIR")
+CACHE_SPILL_MAX_BYTES = int(os.environ.get("CACHE_SPILL_MAX_BYTES", 20 * 1024 ** 3))
+
+_registry = weakref.WeakSet()  # 名前付きキャッシュ
+# セッションが FilterEngine などを作ると登録が増えるため、登録と一覧の取得はロックで保護する
+_registry_lock = threading.Lock()
+_budget_lock = threading.Lock()
+_ticks = count()  # 全キャッシュ共通のアクセス順
+
+
+def content_hash(data: bytes) -> str:
+    """アップロードされたファイル内容のハッシュ（キャッシュキー用）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def estimate_nbytes(value) -> int:
+    """キャッシュ対象のおおよそのメモリ使用量（バイト）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value.values())
+    # numpy 配列や nbytes を持つ独自オブジェクト
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, (int, np.integer)):
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+def _column_arrays(s: pd.Series) -> list:
+    # 列の値を保持している配列（カテゴリはコード、pyarrow の列はバッファ）
+    values = s.array
+    if isinstance(values, pd.Categorical):
+        return [values.codes]
+    if hasattr(values, "__arrow_array__"):
+        arrow = values.__arrow_array__()
+        chunks = getattr(arrow, "chunks", [arrow])
+        return [np.frombuffer(buf, dtype=np.uint8) for chunk in chunks for buf in chunk.buffers()
+                if buf is not None and buf.size]
+    data = getattr(values, "_data", None)  # nullable 整数型など
+    return [data if isinstance(data, np.ndarray) else np.asarray(values)]
+
+
+def frame_nbytes(df: pd.DataFrame, base: pd.DataFrame = None) -> int:
+    """df のメモリ使用量。base の同名列と配列を共有している列は数えない（キャッシュ間の二重計上を避ける）"""
+    size = int(df.index.memory_usage(deep=True))
+    for i, col in enumerate(df.columns):
+        s = df.iloc[:, i]
+        if base is not None and col in base.columns and isinstance(base[col], pd.Series):
+            shared = _column_arrays(base[col])
+            if all(any(np.may_share_memory(a, b) for b in shared) for a in _column_arrays(s)):
+                continue
+        size += int(s.memory_usage(index=False, deep=True))
+    return size
+
+
+def spill_key(key) -> str:
+    """キャッシュキーのディスク退避用のファイル名"""
+    return hashlib.blake2b(repr(key).encode("utf-8"), digest_size=20).hexdigest()
+
+
+class LRUCache:
+    """件数（max_entries）とメモリ（max_bytes）の両方で追い出す LRU キャッシュ。
+
+    Streamlit のセッションは別スレッドで動くため、操作はロックで保護する。
+    name を付けるとプロセス全体のメモリ上限と cache_stats() の対象になる。
+    spill=True なら CACHE_SPILL_DIR/<name> に追い出した値を退避する（値は pickle できること）。
+    """
+
+    def __init__(self, max_entries: int = 8, max_bytes: int = 1024 ** 3, name: str = None, spill: bool = False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.name = name
+        self.spill_dir = os.path.join(CACHE_SPILL_DIR, name) if spill and name and CACHE_SPILL_DIR else None
+        self._items = OrderedDict()  # key -> (value, nbytes, tick)
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._inflight = {}  # 計算中のキー -> 完了を知らせる Event
+        self.hits = 0
+        self.misses = 0
+        if name:
+            with _registry_lock:
+                _registry.add(self)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _touch(self, key):
+        value, nbytes, _ = self._items[key]
+        self._items[key] = (value, nbytes, next(_ticks))
+        self._items.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                return self._touch(key)
+        value = self._load_spilled(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return default
+        return self.put(key, value, spill=False)
+
+    def put(self, key, value, spill: bool = True):
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._items:
+                self._total_bytes -= self._items.pop(key)[1]
+            # 単体で上限を超えるものは保持しない
+            if nbytes > self.max_bytes:
+                evicted = [(key, value)]
+            else:
+                self._items[key] = (value, nbytes, next(_ticks))
+                self._total_bytes += nbytes
+                evicted = self._evict()
+        if spill:
+            self._spill(evicted)
+        if self.name:
+            _enforce_shared_budget()
+        return value
+
+    def get_or_compute(self, key, compute):
+        while True:
+            with self._lock:
+                if key in self._items:
+                    self.hits += 1
+                    return self._touch(key)
+                event = self._inflight.get(key)
+                if event is None:
+                    # このスレッドが計算する
+                    event = self._inflight[key] = threading.Event()
+                    break
+            # 他セッションが同じキーを計算中なら終わるのを待って取り直す
+            event.wait()
+
+        try:
+            value = self._load_spilled(key)
+            if value is not None:
+                return self.put(key, value, spill=False)
+            with self._lock:
+                self.misses += 1
+            # 計算中はロックを外す（他のキーの取得は止めない）
+            return self.put(key, compute())
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._total_bytes = 0
+
+    def _evict(self) -> list:
+        evicted = []
+        while self._items and (len(self._items) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, (value, nbytes, _) = self._items.popitem(last=False)
+            self._total_bytes -= nbytes
+            evicted.append((key, value))
+        return evicted
+
+    def _oldest_tick(self):
+        with self._lock:
+            if not self._items:
+                return None
+            return next(iter(self._items.values()))[2]
+
+    def _evict_oldest(self):
+        with self._lock:
+            if not self._items:
+                return
+            key, (value, nbytes, _) = self._items.popitem(last=False)
+            self._total_bytes -= nbytes
+        self._spill([(key, value)])
+
+    def _spill(self, items: list):
+        if self.spill_dir is None or not items:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for key, value in items:
+            path = os.path.join(self.spill_dir, f"{spill_key(key)}.pkl")
+            if os.path.exists(path):
+                os.utime(path)
+                continue
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except (OSError, pickle.PicklingError, TypeError, AttributeError):
+                # 退避できない値（ロックを持つオブジェクトなど）は捨てる
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        _trim_spill_dir(self.spill_dir)
+
+    def _load_spilled(self, key):
+        if self.spill_dir is None:
+            return None
+        path = os.path.join(self.spill_dir, f"{spill_key(key)}.pkl")
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(path)
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"name": self.name, "entries": len(self._items), "bytes": self._total_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def _registered_caches() -> list:
+    with _registry_lock:
+        return list(_registry)
+
+
+def _enforce_shared_budget():
+    """名前付きキャッシュの合計が上限を超えていたら、全体で最も古いものから追い出す"""
+    with _budget_lock:
+        caches = _registered_caches()
+        while sum(c.total_bytes for c in caches) > SHARED_CACHE_MAX_BYTES:
+            candidates = [(tick, c) for c in caches if (tick := c._oldest_tick()) is not None]
+            if not candidates:
+                break
+            min(candidates, key=lambda item: item[0])[1]._evict_oldest()
+
+
+def _trim_spill_dir(spill_dir: str):
+    # 退避ファイル全体が上限を超えたら更新の古いものから消す
+    root = os.path.dirname(spill_dir)
+    files = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(".pkl"):
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= CACHE_SPILL_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def cache_stats() -> list:
+    """名前付きキャッシュごとの 件数・メモリ・ヒット数・ミス数（同じ名前のキャッシュは合算）"""
+    totals = {}
+    for stat in (c.stats() for c in _registered_caches()):
+        total = totals.setdefault(stat["name"], dict(stat, entries=0, bytes=0, hits=0, misses=0))
+        for field in ("entries", "bytes", "hits", "misses"):
+            total[field] += stat[field]
+    return sorted(totals.values(), key=lambda stat: stat["name"])
@@ -0,0 +1,76 @@
+"""項目別の件数＋取扱高グラフ・時系列トレンドのグラフ（Streamlit 画面とバッチレポートで共用）。"""
+import plotly.graph_objects as go
+
+from aggregate import chart_cols
+from binning import category_orders
+
+
+def create_dual_axis_grouped_chart(summary, category_col, title):
+    # 非空チェック（summary は項目の値ごとの 件数・取扱高）
+    if summary.empty:
+        return go.Figure()
+
+    # カテゴリ順序対応
+    if category_col in category_orders:
+        summary = summary.reindex(category_orders[category_col]).fillna(0)
+    count_data = summary["件数"]
+    sum_data = summary["取扱高"]
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=count_data.index,
+        y=count_data.values,
+        name="件数",
+        marker_color="skyblue",
+        offsetgroup=0,
+        yaxis="y"
+    ))
+    fig.add_trace(go.Bar(
+        x=sum_data.index,
+        y=sum_data.values,
+        name="取扱高（円）",
+        marker_color="orange",
+        offsetgroup=1,
+        yaxis="y2"
+    ))
+    fig.update_layout(
+        title=f"{title}（件数＋取扱高）",
+        xaxis=dict(title=category_col),
+        yaxis=dict(title="件数", side="left"),
+        yaxis2=dict(title="取扱高（円）", overlaying="y", side="right"),
+        barmode="group",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+
+def chart_figures(cube, mask, key=None):
+    """chart_cols のうちデータのある項目について (タイトル, 列, Figure) を順に返す"""
+    summaries = cube.summaries([col for _, col in chart_cols], mask, key)
+    for title, col in chart_cols:
+        if col in summaries and not summaries[col].empty:
+            yield title, col, create_dual_axis_grouped_chart(summaries[col], col, title)
+
+
+def create_trend_chart(series, metric, by=None, window=0):
+    """期間ごとの metric の折れ線（by があれば値ごと、window があれば移動平均も点線で重ねる）"""
+    fig = go.Figure()
+    if series.empty:
+        return fig
+    moving_col = f"{metric}（{window}期間移動平均）"
+    groups = series.groupby(by, sort=False) if by else [(None, series)]
+    for name, part in groups:
+        label = metric if name is None else str(name)
+        fig.add_trace(go.Scatter(x=part["期間"], y=part[metric], mode="lines+markers", name=label,
+                                 legendgroup=label))
+        if moving_col in part.columns:
+            fig.add_trace(go.Scatter(x=part["期間"], y=part[moving_col], mode="lines",
+                                     name=f"{label}（移動平均）", legendgroup=label,
+                                     line=dict(dash="dot")))
+    fig.update_layout(
+        title=f"{metric}の推移" + (f"（{by}別）" if by else ""),
+        xaxis=dict(title="期間"),
+        yaxis=dict(title=metric),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
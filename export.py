@@ -0,0 +1,56 @@
+"""ダウンロード用ファイルの作成（CSV・gzip圧縮CSV・Parquet）。
+
+ファイルはダウンロードボタンが押されたときに初めて作り、フィルタ状態などの
+キーごとにキャッシュする。CSV は一定行数ごとに書き出して、全体の文字列と
+バイト列を同時に持たないようにする。
+"""
+import gzip
+import io
+
+import pandas as pd
+
+from cache import LRUCache
+from store import parquet_safe
+
+# 表示名 -> (拡張子, MIMEタイプ)
+export_formats = {
+    "CSV（UTF-8 BOM付き）": ("csv", "text/csv"),
+    "CSV（gzip圧縮）": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+CSV_CHUNK_ROWS = 100_000
+
+_export_cache = LRUCache(max_entries=16, max_bytes=1024 ** 3, name="export")
+
+
+def iter_csv_chunks(df: pd.DataFrame, chunk_rows: int = CSV_CHUNK_ROWS):
+    """df を CSV（UTF-8 BOM付き）のバイト列として chunk_rows 行ずつ返す"""
+    yield "\ufeff".encode("utf-8")
+    if len(df) == 0:
+        yield df.to_csv(index=False).encode("utf-8")
+        return
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(index=False, header=(start == 0)).encode("utf-8")
+
+
+def export_bytes(df: pd.DataFrame, fmt: str) -> bytes:
+    """df を export_formats の形式 fmt のバイト列にする"""
+    ext, _ = export_formats[fmt]
+    buf = io.BytesIO()
+    if ext == "csv":
+        for chunk in iter_csv_chunks(df):
+            buf.write(chunk)
+    elif ext == "csv.gz":
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6) as gz:
+            for chunk in iter_csv_chunks(df):
+                gz.write(chunk)
+    else:
+        parquet_safe(df).to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+def cached_export(key, make_frame, fmt: str) -> bytes:
+    """(key, fmt) ごとにキャッシュしたダウンロード用バイト列。make_frame はキャッシュに無いときだけ呼ばれる"""
+    return _export_cache.get_or_compute((key, fmt), lambda: export_bytes(make_frame(), fmt))
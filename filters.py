@@ -0,0 +1,145 @@
+"""サイドバーのフィルタ（申込日範囲・カテゴリ・媒体名・承認区分・性別）の絞り込み。
+
+データセットごとに FilterEngine を一度だけ作り、各列のコード配列・値ごとの
+ブールマスク・申込日のソート済み索引を保持する。フィルタ操作ではマスクの
+AND を取るだけで、選択が変わっていないフィルタのマスクは再計算しない。
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, frame_nbytes
+
+# 値選択で絞り込む列（サイドバーの表示順）
+filter_cols = ["カテゴリ", "媒体名", "承認区分", "性別"]
+
+# これ以下の選択数なら値ごとのマスクの OR、超えたらコード表の引き当てで作る
+_VALUE_MASK_LIMIT = 8
+
+_engine_cache = LRUCache(max_entries=4, max_bytes=4 * 1024 ** 3, name="filter_engine")
+
+
+class FilterEngine:
+    """1つのデータセットに対するフィルタ用の索引とマスクのキャッシュ
+
+    base には df の元になった（別のキャッシュが持つ）DataFrame を渡せる。base と共有している列は
+    nbytes に数えない。
+    """
+
+    def __init__(self, df: pd.DataFrame, base: pd.DataFrame = None):
+        self.df = df
+        self._n = len(df)
+        self._df_nbytes = frame_nbytes(df, base)
+
+        # 値選択列: 昇順のカテゴリとコード（欠損は -1）
+        self._codes = {}
+        self._categories = {}
+        for col in filter_cols:
+            if col in df.columns:
+                codes, uniques = pd.factorize(df[col], sort=True)
+                self._codes[col] = codes
+                self._categories[col] = pd.Index(uniques)
+
+        # 申込日: NaT を除いた行番号を日付順に並べた索引
+        self._date_order = None
+        self._date_sorted = None
+        if '申込日' in df.columns:
+            values = df['申込日'].to_numpy(dtype="datetime64[ns]")
+            valid = np.flatnonzero(~np.isnat(values))
+            order = valid[np.argsort(values[valid], kind="stable")]
+            self._date_order = order
+            self._date_sorted = values[order]
+
+        # 値ごと・選択ごとのマスク（名前付きにしてプロセス全体のメモリ上限の対象にする）
+        self._mask_cache = LRUCache(max_entries=256, max_bytes=512 * 1024 ** 2, name="filter_masks")
+
+    @property
+    def nbytes(self) -> int:
+        # マスクのキャッシュは自身で数えるため含めない
+        size = self._df_nbytes
+        size += sum(codes.nbytes for codes in self._codes.values())
+        if self._date_order is not None:
+            size += self._date_order.nbytes + self._date_sorted.nbytes
+        return size
+
+    def has_filter(self, col: str) -> bool:
+        return col in self._codes
+
+    @property
+    def has_dates(self) -> bool:
+        return self._date_order is not None
+
+    def date_bounds(self):
+        """申込日の最小・最大（NaT のみなら None）"""
+        if not self.has_dates or len(self._date_sorted) == 0:
+            return None
+        return (pd.Timestamp(self._date_sorted[0]).date(), pd.Timestamp(self._date_sorted[-1]).date())
+
+    def date_mask(self, start_date: date, end_date: date) -> np.ndarray:
+        """start_date <= 申込日 <= end_date の行（二分探索で範囲を求める）"""
+        key = ("申込日", start_date, end_date)
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            start = np.datetime64(pd.to_datetime(start_date), "ns")
+            end = np.datetime64(pd.to_datetime(end_date), "ns")
+            lo = np.searchsorted(self._date_sorted, start, side="left")
+            hi = np.searchsorted(self._date_sorted, end, side="right")
+            mask = np.zeros(self._n, dtype=bool)
+            mask[self._date_order[lo:hi]] = True
+            self._mask_cache.put(key, mask)
+        return mask
+
+    def value_mask(self, col: str, code: int) -> np.ndarray:
+        return self._mask_cache.get_or_compute(("値", col, code), lambda: self._codes[col] == code)
+
+    def isin_mask(self, col: str, values) -> np.ndarray:
+        """col が values のいずれかに一致する行"""
+        key = (col, frozenset(values))
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            codes = self._categories[col].get_indexer(list(values))
+            codes = np.unique(codes[codes >= 0])
+            if len(codes) <= _VALUE_MASK_LIMIT:
+                mask = np.zeros(self._n, dtype=bool)
+                for code in codes:
+                    mask |= self.value_mask(col, code)
+            else:
+                # 末尾を欠損（-1）用にしたコード表で一括引き当て
+                table = np.zeros(len(self._categories[col]) + 1, dtype=bool)
+                table[codes] = True
+                mask = table[self._codes[col]]
+            self._mask_cache.put(key, mask)
+        return mask
+
+    def combine(self, masks) -> np.ndarray:
+        """None（絞り込みなし）を除いたマスクの AND"""
+        result = np.ones(self._n, dtype=bool)
+        for mask in masks:
+            if mask is not None:
+                result &= mask
+        return result
+
+    def options(self, col: str, mask: np.ndarray) -> list:
+        """mask の行に現れる col の値（昇順、欠損除く）"""
+        codes = self._codes[col][mask]
+        present = np.bincount(codes[codes >= 0], minlength=len(self._categories[col])) > 0
+        return self._categories[col][present].tolist()
+
+    def materialize(self, mask: np.ndarray) -> pd.DataFrame:
+        """mask の行を DataFrame として取り出す（絞り込みなしならコピーせず元の DataFrame を返す）
+
+        返り値はセッション間で共有されることがあるため、呼び出し側で直接変更しないこと。
+        """
+        if mask.all():
+            return self.df
+        return self.df[mask]
+
+
+def load_filter_engine(key, build_df, base: pd.DataFrame = None) -> FilterEngine:
+    """key（データセット・マスタの組）ごとに FilterEngine を作って使い回す
+
+    build_df は絞り込み対象の DataFrame を返す関数で、キャッシュに無いときだけ呼ばれる。
+    base は build_df の元になった DataFrame（FilterEngine を参照）。
+    """
+    return _engine_cache.get_or_compute(key, lambda: FilterEngine(build_df(), base))
@@ -0,0 +1,370 @@
+"""後方数値データ（アップロードExcel）の読み込みと整形。
+
+整形済みの DataFrame はファイル内容のハッシュをキーにキャッシュするため、
+同じファイルのままフィルタやピボットを操作しても読み込み・整形は再実行されない。
+整形の最後に dtype_plan に従って型を縮小し、セッションあたりのメモリを抑える。
+複数ファイル（月ごとの出力）もファイルごとにキャッシュし、未読のファイルだけを
+プロセスプールで並列に読み込む。列を検証してから結合し、ファイル間で重複する申込を除く。
+"""
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, content_hash
+from profiling import stage
+
+# 数値として扱う列
+numeric_cols = [
+    '年齢', '年収', '同借希望額', '住宅ローン返済月額', '勤続年数',
+    '他社借入件数', '取扱金額_申込当月', '取扱金額_申込翌月末', '取扱金額_申込翌々月末'
+]
+
+# 取扱高の内訳列
+amount_cols = ['取扱金額_申込当月', '取扱金額_申込翌月末', '取扱金額_申込翌々月末']
+
+# ダッシュボード（フィルタ・グラフ・ピボット・一覧）で参照する列
+dashboard_cols = (
+    ['申込日', '媒体コード', '媒体名', 'カテゴリ', '性別', '承認区分',
+     '都道府県', '利用目的', '家族構成', '子供数', '勤務状況']
+    + numeric_cols + ['取扱高']
+)
+
+# 複数ファイル読み込み時に必須の列
+required_cols = ['申込日', '媒体コード']
+
+# 申込を識別する列の候補（先に見つかった列と 申込日 の組で重複を判定）
+application_key_candidates = ['申込番号', '申込ID', '受付番号', '会員番号']
+
+# アップロードExcelから読む列（ダッシュボードで参照する列と重複判定用の列）
+read_cols = dashboard_cols + application_key_candidates
+
+# 列ごとの型の方針
+#   category: 値の種類が少ない列
+#   numeric : 整数値だけなら最小の整数型に縮小（小数を含む列は float64 のまま）
+# 方針に無い文字列の列は pyarrow の文字列型にする
+dtype_plan = {
+    '媒体コード': 'category', '媒体名': 'category', 'カテゴリ': 'category',
+    '性別': 'category', '都道府県': 'category', '利用目的': 'category',
+    '家族構成': 'category', '勤務状況': 'category', '承認区分': 'category',
+    '子供数': 'numeric', '取扱高': 'numeric',
+    **{col: 'numeric' for col in numeric_cols},
+}
+
+# キャッシュ上限（ファイル数・メモリ）。複数ファイルは1ファイル1件と結合結果1件を使う
+INGEST_CACHE_MAX_ENTRIES = 16
+INGEST_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# 整形済みデータは作り直しに時間がかかるため、CACHE_SPILL_DIR があればディスクに退避する
+_ingest_cache = LRUCache(max_entries=INGEST_CACHE_MAX_ENTRIES, max_bytes=INGEST_CACHE_MAX_BYTES,
+                         name="ingest", spill=True)
+
+
+@dataclass
+class IngestResult:
+    """複数ファイルの読み込み結果"""
+    df: pd.DataFrame                             # 読み込めたファイルが無ければ None
+    key: str
+    skipped: dict = field(default_factory=dict)  # ファイル名 -> 読み込まなかった理由
+    duplicates: int = 0                          # ファイル間の重複として除いた行数
+    key_cols: list = field(default_factory=list)  # 重複判定に使った列
+
+    @property
+    def nbytes(self) -> int:
+        if self.df is None:
+            return 0
+        return int(self.df.memory_usage(index=True, deep=True).sum())
+
+
+def normalize_columns(columns) -> list:
+    """列名の前後空白・全角空白・NBSP を除去"""
+    return [str(c).strip().replace('\u3000', '').replace('\xa0', '') for c in columns]
+
+
+def _downcast_numeric(s: pd.Series) -> pd.Series:
+    """整数値だけの数値列を最小の整数型（欠損があれば nullable 整数型）にする"""
+    if not pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return s
+    values = s.to_numpy(dtype="float64", na_value=np.nan)
+    present = values[~np.isnan(values)]
+    if len(present) == 0 or not np.isfinite(present).all() or (present != np.round(present)).any():
+        return s
+    if len(present) == len(values):
+        return pd.to_numeric(s.astype("int64"), downcast="integer")
+    lo, hi = present.min(), present.max()
+    for dtype in ("Int8", "Int16", "Int32", "Int64"):
+        info = np.iinfo(dtype.lower())
+        if info.min <= lo and hi <= info.max:
+            return s.astype(dtype)
+    return s
+
+
+def _string_dtype():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    return pd.StringDtype("pyarrow")
+
+
+def apply_dtype_plan(df: pd.DataFrame) -> pd.DataFrame:
+    """dtype_plan に従って列の型を縮小する"""
+    string_dtype = _string_dtype()
+    for col in df.columns:
+        kind = dtype_plan.get(col)
+        if kind == 'category':
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        elif kind == 'numeric':
+            df[col] = _downcast_numeric(df[col])
+        elif string_dtype is not None and df[col].dtype == object \
+                and pd.api.types.infer_dtype(df[col], skipna=True) == 'string':
+            df[col] = df[col].astype(string_dtype)
+    return df
+
+
+def clean_uploaded_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """読み込んだ後方数値データを分析用に整形する"""
+    df.columns = normalize_columns(df.columns)
+
+    # 性別整形（例：'xxx_男性' → '男性'）
+    if '性別' in df.columns:
+        df['性別'] = df['性別'].astype(str).str.extract(r'_(男性|女性)', expand=False).fillna(df['性別'])
+
+    # 数値列変換（存在チェック付き）
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # 申込日 → datetime
+    if '申込日' in df.columns:
+        df['申込日'] = pd.to_datetime(df['申込日'], errors='coerce')
+
+    # 取扱高計算（不足列は0で補完）
+    for c in amount_cols:
+        if c not in df.columns:
+            df[c] = 0
+    df['取扱高'] = df[amount_cols].sum(axis=1)
+
+    # 承認区分のNULL処理
+    if '承認区分' in df.columns:
+        df['承認区分'] = df['承認区分'].fillna('NULL')
+    else:
+        df['承認区分'] = 'NULL'
+
+    return apply_dtype_plan(df)
+
+
+def _has_calamine() -> bool:
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _typed_column(col: str, values: list) -> pd.Series:
+    # 読み込みと同時に型を付ける（数値列・申込日以外は pandas の推定に任せる）
+    if col in numeric_cols:
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+    if col == '申込日':
+        return pd.to_datetime(pd.Series(values, dtype=object), errors='coerce')
+    return pd.Series(values).infer_objects()
+
+
+def _read_calamine(data: bytes, columns: list) -> pd.DataFrame:
+    # calamine はシート全体を読んでから列を絞るため、読み込み中の列の削減や型付けはしない
+    wanted = set(columns)
+    df = pd.read_excel(io.BytesIO(data), engine='calamine',
+                       usecols=lambda c: normalize_columns([c])[0] in wanted)
+    if len(df.columns) == 0:
+        raise ValueError("読み込む列がヘッダー行にありません")
+    df.columns = normalize_columns(df.columns)
+    return df
+
+
+def _read_openpyxl_stream(data: bytes, columns: list) -> pd.DataFrame:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = normalize_columns(['' if c is None else c for c in next(rows, ())])
+        wanted = set(columns)
+        # ヘッダー行から必要な列の位置を決める（重複名は先の列）
+        positions = {}
+        for i, name in enumerate(header):
+            if name in wanted and name not in positions:
+                positions[name] = i
+        names = list(positions)
+        if not names:
+            raise ValueError("読み込む列がヘッダー行にありません")
+        width = max(positions.values(), default=-1) + 1
+        pad = (None,) * width
+
+        values = [[] for _ in names]
+        idx = list(positions.values())
+        last = -1
+        for n, row in enumerate(rows):
+            if len(row) < width:
+                row = row + pad[len(row):]
+            picked = [row[i] for i in idx]
+            for column, value in zip(values, picked):
+                column.append(value)
+            if any(v is not None for v in picked):
+                last = n
+    finally:
+        wb.close()
+    # 末尾の空行を除く
+    return pd.DataFrame({name: _typed_column(name, column[:last + 1]) for name, column in zip(names, values)})
+
+
+def read_workbook_columns(data: bytes, columns: list = None) -> pd.DataFrame:
+    """Excelの先頭シートから columns の列だけを読む（列名の空白・全角空白・NBSP は除いて照合）
+
+    python-calamine があれば calamine、無ければ openpyxl の read_only で行を流し読みする。
+    calamine は全セルを読んでから列を絞る（読み込み時の列の削減・型付けは openpyxl の経路だけ）。
+    どちらも失敗したら（必要な列が1つも無い場合を含む）従来どおり pd.read_excel で全列を読む。
+    """
+    columns = read_cols if columns is None else columns
+    readers = [_read_calamine] if _has_calamine() else []
+    readers.append(_read_openpyxl_stream)
+    for reader in readers:
+        try:
+            return reader(data, columns)
+        except Exception:
+            continue
+    return pd.read_excel(io.BytesIO(data))
+
+
+def load_uploaded_workbook(data: bytes, key: str = None) -> pd.DataFrame:
+    """アップロードされたExcelのバイト列から整形済み DataFrame を返す（内容ハッシュでキャッシュ）
+
+    key には計算済みの content_hash(data) を渡せる。
+    返り値はセッション間で共有されるため、呼び出し側で直接変更しないこと。
+    """
+    key = key or content_hash(data)
+    return _ingest_cache.get_or_compute(key, lambda: read_workbook(data))
+
+
+def read_workbook(data: bytes) -> pd.DataFrame:
+    """Excelのバイト列を読み込んで整形する（ワーカープロセスからも呼ばれる）"""
+    with stage("read"):
+        df = read_workbook_columns(data)
+    with stage("normalize"):
+        return clean_uploaded_frame(df)
+
+
+def missing_columns(df: pd.DataFrame) -> list:
+    return [col for col in required_cols if col not in df.columns]
+
+
+def application_key_cols(frames: list) -> list:
+    """重複判定に使う列
+
+    識別列はすべてのファイルにあり値が入っているときだけ使う。無ければ 申込日 を含む
+    全列が一致する行を重複とみなす（識別列の無いファイルの行を同じ申込として扱わないため）。
+    """
+    for col in application_key_candidates:
+        if all(col in f.columns and f[col].notna().any() for f in frames):
+            return ['申込日', col]
+    return list(dict.fromkeys(col for f in frames for col in f.columns))
+
+
+def drop_cross_file_duplicates(df: pd.DataFrame, file_ids: np.ndarray, key_cols: list):
+    """先に読んだファイルと重複する行を除く（同じファイル内の重複は残す）"""
+    hashes = pd.util.hash_pandas_object(df[key_cols], index=False).to_numpy()
+    first_file = pd.Series(file_ids).groupby(hashes).transform('min').to_numpy()
+    keep = first_file == file_ids
+    if len(key_cols) < len(df.columns):
+        # 識別列で判定するときは、識別列・申込日が欠損の行を重複とみなさない
+        keep |= df[key_cols].isna().any(axis=1).to_numpy()
+    if keep.all():
+        return df, 0
+    return df[keep].reset_index(drop=True), int((~keep).sum())
+
+
+def _parse_workbooks(datas: list, max_workers: int = None) -> list:
+    """各Excelを読み込み、例外はファイルごとに返す（2件以上ならプロセスプールで並列）"""
+    workers = min(len(datas), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        results = []
+        for data in datas:
+            try:
+                results.append(read_workbook(data))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    # Streamlit のサーバーは複数スレッドで動くため fork しない（他スレッドが持つロックを子が引き継いで止まる）
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(read_workbook, data) for data in datas]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def _load_workbooks(datas: list, keys: list, max_workers: int = None) -> list:
+    """各Excelの整形結果（ファイル内容ハッシュごとにキャッシュ）。読み込めなかったファイルは例外を返す"""
+    if len(keys) == 1:
+        # 1ファイルなら同じファイルを同時に読む別セッションと読み込みを1回にまとめる
+        try:
+            return [load_uploaded_workbook(datas[0], keys[0])]
+        except Exception as e:
+            return [e]
+
+    results = {key: _ingest_cache.get(key) for key in keys}
+    misses = {key: data for key, data in zip(keys, datas) if results[key] is None}
+    if misses:
+        # 前回までに読んだファイルは読み直さず、新しいファイルだけを並列に読む
+        for key, result in zip(misses, _parse_workbooks(list(misses.values()), max_workers)):
+            results[key] = result if isinstance(result, Exception) else _ingest_cache.put(key, result)
+    return [results[key] for key in keys]
+
+
+def load_uploaded_workbooks(files: list, max_workers: int = None) -> IngestResult:
+    """複数の (ファイル名, バイト列) を並列に読み込み、検証・結合・重複除去した結果を返す
+
+    1ファイルだけなら load_uploaded_workbook と同じ整形結果になる（必須列の検証もしない）。
+    各ファイルの整形結果はファイル内容ハッシュで、結合結果はその組でキャッシュする。
+    結果はセッション間で共有されるため直接変更しないこと。
+    """
+    keys = [content_hash(data) for _, data in files]
+    key = keys[0] if len(keys) == 1 else content_hash("|".join(keys).encode())
+
+    def _load():
+        parsed = _load_workbooks([data for _, data in files], keys, max_workers)
+        skipped, frames = {}, []
+        for (name, _), result in zip(files, parsed):
+            if isinstance(result, Exception):
+                skipped[name] = f"読み込みに失敗しました（{result}）"
+            elif len(files) > 1 and missing_columns(result):
+                skipped[name] = f"必須列がありません（{'・'.join(missing_columns(result))}）"
+            else:
+                frames.append(result)
+        if not frames:
+            return IngestResult(None, key, skipped)
+        if len(frames) == 1:
+            return IngestResult(frames[0], key, skipped)
+
+        file_ids = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+        # ファイルごとにカテゴリが異なると結合で object に戻るため、型を付け直す
+        df = apply_dtype_plan(pd.concat(frames, ignore_index=True))
+        key_cols = application_key_cols(frames)
+        df, duplicates = drop_cross_file_duplicates(df, file_ids, key_cols)
+        return IngestResult(df, key, skipped, duplicates, key_cols)
+
+    if len(files) == 1:
+        # 整形結果はファイルごとのキャッシュにあるため、結果を二重に持たない
+        return _load()
+    return _ingest_cache.get_or_compute(("files", key), _load)
@@ -0,0 +1,100 @@
+"""媒体コードマスタの読み込みと 媒体コード → 媒体名/カテゴリ の引き当て。
+
+マスタは月ごとのコード列を持つ横持ちの表のため、縦持ちにしたうえで
+媒体コードを一意にした索引を作る。同じコードが複数行に現れても
+後方数値データの行が増えることはなく、食い違うコードは conflicts に残す。
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+from ingest import normalize_columns
+
+# 引き当てで付与する列（マージ時の列順と同じ）
+lookup_cols = ["媒体名", "カテゴリ", "コード列"]
+
+# パスと更新時刻をキーに保持（マスタ更新時は自動で読み直す）
+_master_cache = LRUCache(max_entries=2, max_bytes=256 * 1024 ** 2, name="master")
+
+
+@dataclass
+class MasterIndex:
+    lookup: pd.DataFrame     # index: 媒体コード（一意）、列: lookup_cols（category型）
+    conflicts: pd.DataFrame  # 媒体名/カテゴリが食い違う媒体コードの一覧
+    key: tuple = None        # 読み込み元（パス・更新時刻）
+
+    @property
+    def empty(self) -> bool:
+        return self.lookup.empty
+
+
+def read_master(master_path: str) -> pd.DataFrame:
+    """マスタExcelを読み込み、列名を整形する"""
+    master = pd.read_excel(master_path)
+    master.columns = normalize_columns(master.columns)
+    master.rename(columns={"会社名": "媒体名"}, inplace=True)
+    return master
+
+
+def build_master_index(master: pd.DataFrame, key: tuple = None) -> MasterIndex:
+    """横持ちのマスタから 媒体コード を一意キーとする索引を作る"""
+    id_vars = [col for col in master.columns if col in ["媒体名", "カテゴリ"]]
+    code_cols = [col for col in master.columns if col not in id_vars]
+    master_long = master.melt(id_vars=id_vars, value_vars=code_cols,
+                              var_name="コード列", value_name="媒体コード").dropna(subset=["媒体コード"])
+    for col in ["媒体名", "カテゴリ"]:
+        if col not in master_long.columns:
+            master_long[col] = pd.NA
+
+    # 同じコードに別の媒体名/カテゴリが付いているものを抽出
+    pairs = master_long.drop_duplicates(subset=["媒体コード", "媒体名", "カテゴリ"])
+    dup_mask = pairs.duplicated(subset=["媒体コード"], keep=False)
+    conflicts = (
+        pairs.loc[dup_mask, ["媒体コード", "媒体名", "カテゴリ", "コード列"]]
+        .sort_values(by=["媒体コード", "コード列"])
+        .reset_index(drop=True)
+    )
+
+    # 先に出現した行を採用してコードを一意にする
+    lookup = (
+        master_long.drop_duplicates(subset=["媒体コード"], keep="first")
+        .set_index("媒体コード")[lookup_cols]
+        .astype("category")
+    )
+    return MasterIndex(lookup=lookup, conflicts=conflicts, key=key)
+
+
+def load_master_index(master_path: str) -> MasterIndex:
+    """マスタ索引を返す（ファイルの更新時刻が変わるまで再読み込みしない）"""
+    key = (os.path.abspath(master_path), os.stat(master_path).st_mtime_ns)
+    return _master_cache.get_or_compute(key, lambda: build_master_index(read_master(master_path), key=key))
+
+
+def apply_master(df: pd.DataFrame, index: MasterIndex) -> pd.DataFrame:
+    """媒体コードで媒体名・カテゴリ・コード列（category型）を引き当てた DataFrame を返す（行数は変わらない）
+
+    元の列は df と共有する（浅いコピーに列を追加するだけ）。
+    """
+    pos = index.lookup.index.get_indexer(df["媒体コード"])
+    found = pos >= 0
+    merged_df = df.copy(deep=False)
+    for col in lookup_cols:
+        cat = index.lookup[col].cat
+        codes = np.where(found, cat.codes.to_numpy()[np.where(found, pos, 0)], -1)
+        merged_df[col] = pd.Series(pd.Categorical.from_codes(codes, dtype=index.lookup[col].dtype), index=df.index)
+    return merged_df
+
+
+def attach_master(df: pd.DataFrame, index: MasterIndex) -> pd.DataFrame:
+    """マスタと突合した DataFrame を返す（媒体コードが無い場合は媒体名・カテゴリを欠損で補完）"""
+    if '媒体コード' in df.columns and not index.empty:
+        return apply_master(df, index)
+    merged_df = df.copy(deep=False)
+    if '媒体名' not in merged_df.columns:
+        merged_df['媒体名'] = pd.NA
+    if 'カテゴリ' not in merged_df.columns:
+        merged_df['カテゴリ'] = pd.NA
+    return merged_df
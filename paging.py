@@ -0,0 +1,43 @@
+"""フィルタ後データ一覧のページ分割（並べ替え・列選択はサーバー側で行う）。
+
+ブラウザへ送るのは表示中のページの行と列だけにし、表示件数がデータ量に
+比例して増えないようにする。並べ替え後の行位置はフィルタ状態・並べ替え条件ごとに
+キャッシュし、ページ送りでは切り出すだけにする。
+"""
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+
+page_sizes = [50, 100, 500, 1000]
+
+_order_cache = LRUCache(max_entries=16, max_bytes=512 * 1024 ** 2, name="page_order")
+
+
+def page_count(n_rows: int, page_size: int) -> int:
+    return max(1, -(-n_rows // page_size))
+
+
+def sorted_positions(df: pd.DataFrame, mask: np.ndarray, sort_col: str = None,
+                     ascending: bool = True, key=None) -> np.ndarray:
+    """mask の行の位置を sort_col で並べ替えて返す（欠損は末尾、同順位は元の順）
+
+    key を渡すと (key, sort_col, ascending) ごとに結果をキャッシュする。
+    """
+    def _compute():
+        positions = np.flatnonzero(mask)
+        if sort_col is None:
+            return positions
+        values = df[sort_col].iloc[positions].reset_index(drop=True)
+        order = values.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+        return positions[order]
+
+    if key is None:
+        return _compute()
+    return _order_cache.get_or_compute((key, sort_col, ascending), _compute)
+
+
+def page_frame(df: pd.DataFrame, positions: np.ndarray, page: int, page_size: int, columns: list) -> pd.DataFrame:
+    """page（1始まり）ページ目の行を columns の列だけ取り出す"""
+    start = (page - 1) * page_size
+    return df.iloc[positions[start:start + page_size]][columns]
@@ -0,0 +1,175 @@
+"""クロス集計（複数の行・列項目、小計・合計付き）。
+
+AggregationCube の組み合わせごとのコードと 件数・承認件数・取扱高 から、
+行・列の組み合わせの表を NumPy で組み立てる。値を文字列に変換せずコードのまま並べるため、
+区分け列などはカテゴリ順に並ぶ。承認率・平均取扱高は小計・合計でも合計値から計算し直す。
+結果は (データセット・フィルタ状態, 行, 列, 値, 小計, 構成比) ごとにキャッシュする。
+"""
+import numpy as np
+import pandas as pd
+
+from binning import UNKNOWN_LABEL
+from cache import LRUCache
+
+# 値として選べる指標
+pivot_metrics = ["件数", "取扱高合計", "承認率(%)", "平均取扱高"]
+
+# 構成比を出せる（足し合わせられる）指標
+additive_metrics = ["件数", "取扱高合計"]
+
+SUBTOTAL_LABEL = "小計"
+TOTAL_LABEL = "合計"
+
+_pivot_cache = LRUCache(max_entries=64, max_bytes=256 * 1024 ** 2, name="pivot")
+
+
+def _blocks(codes: list, subtotals: bool) -> list:
+    """コード順に並んだ組み合わせを、明細・小計・合計の行（列）の並びにする
+
+    返り値は (ラベル位置のタプル, 開始, 終了) のリストで、開始〜終了の組み合わせを合算した行を表す。
+    ラベル位置は各項目のコード、小計は SUBTOTAL_LABEL、以降の項目は "" になる。
+    """
+    n = len(codes[0]) if codes else 0
+    depth = len(codes)
+    entries = []
+    starts = [0] * depth  # 項目ごとの現在のまとまりの開始位置
+    for i in range(n):
+        entries.append((tuple(c[i] for c in codes), i, i + 1))
+        if not subtotals or depth < 2:
+            continue
+        # 次の組み合わせで上位の項目の値が変わるところで、深い方から小計を入れる
+        for level in range(depth - 2, -1, -1):
+            last = i + 1 == n or any(codes[k][i] != codes[k][i + 1] for k in range(level + 1))
+            if last:
+                label = tuple(codes[k][i] for k in range(level + 1)) + (SUBTOTAL_LABEL,) + ("",) * (depth - level - 2)
+                entries.append((label, starts[level], i + 1))
+                starts[level] = i + 1
+    if n:
+        entries.append(((TOTAL_LABEL,) + ("",) * (depth - 1), 0, n))
+    return entries
+
+
+def _metric(counts: np.ndarray, approvals: np.ndarray, sums: np.ndarray, metric: str) -> np.ndarray:
+    if metric == "件数":
+        return counts
+    if metric == "取扱高合計":
+        return sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == "承認率(%)":
+            return np.round(np.where(counts > 0, approvals / counts * 100, np.nan), 2)
+        return np.round(np.where(counts > 0, sums / counts, np.nan), 0)
+
+
+def _axis_index(cube, dims: list, entries: list) -> pd.Index:
+    labels = [cube.labels(dim) for dim in dims]
+
+    # 集計はコードのまま行い、表示用のラベルだけ文字列にする（数値と 小計/合計 の混在を避ける）
+    def decode(level, value):
+        if isinstance(value, str):
+            return value
+        return UNKNOWN_LABEL if value < 0 else str(labels[level][value])
+
+    tuples = [tuple(decode(level, v) for level, v in enumerate(label)) for label, _, _ in entries]
+    if len(dims) == 1:
+        return pd.Index([t[0] for t in tuples], name=dims[0], dtype=object)
+    return pd.MultiIndex.from_tuples(tuples, names=dims)
+
+
+def _block_sums(grid: np.ndarray, entries: list, axis: int) -> np.ndarray:
+    # 累積和の差でまとまりごとの合計を求める
+    cum = np.cumsum(grid, axis=axis)
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (1, 0)
+    cum = np.pad(cum, pad)
+    starts = np.array([start for _, start, _ in entries], dtype=np.int64)
+    stops = np.array([stop for _, _, stop in entries], dtype=np.int64)
+    return np.take(cum, stops, axis=axis) - np.take(cum, starts, axis=axis)
+
+
+def build_pivot(cube, row_dims: list, col_dims: list, metric: str, mask: np.ndarray, state_key: str,
+                subtotals: bool = True, percent: bool = False, key=None) -> pd.DataFrame:
+    """行 row_dims × 列 col_dims の metric のクロス集計（小計・合計付き）
+
+    col_dims が空なら行ごとの metric の1列（percent なら 構成比(%) 列を加える）。
+    percent は足し合わせられる指標のときだけ有効で、列があれば行方向の構成比にする。
+    key（データセットの識別子）を渡すと結果をキャッシュする。
+    """
+    row_dims = list(dict.fromkeys(row_dims))
+    col_dims = [dim for dim in dict.fromkeys(col_dims) if dim not in row_dims]
+    percent = percent and metric in additive_metrics
+
+    if not row_dims:
+        raise ValueError("行の項目を1つ以上選んでください")
+
+    def _compute():
+        dims = row_dims + col_dims
+        codes, counts, approvals, sums = cube.group_codes(dims, mask, state_key)
+        if len(counts) == 0:
+            return pd.DataFrame()
+
+        # 行・列それぞれの組み合わせ（コード順）と各組み合わせの位置
+        def axis_codes(axis_dims):
+            if not axis_dims:
+                return [], np.zeros(len(counts), dtype=np.int64), 1
+            sizes = [len(cube.labels(dim)) + 1 for dim in axis_dims]
+            combined = np.zeros(len(counts), dtype=np.int64)
+            for dim, size in zip(axis_dims, sizes):
+                combined = combined * size + codes[dim] + 1
+            uniques, inverse = np.unique(combined, return_inverse=True)
+            axis = []
+            for size in reversed(sizes):
+                axis.append(uniques % size - 1)
+                uniques = uniques // size
+            return axis[::-1], inverse, len(axis[0])
+
+        row_codes, row_pos, n_rows = axis_codes(row_dims)
+        col_codes, col_pos, n_cols = axis_codes(col_dims)
+
+        grids = []
+        for values in (counts, approvals, sums):
+            grid = np.zeros((n_rows, n_cols))
+            np.add.at(grid, (row_pos, col_pos), values)
+            grids.append(grid)
+
+        row_entries = _blocks(row_codes, subtotals)
+        grids = [_block_sums(grid, row_entries, axis=0) for grid in grids]
+        index = _axis_index(cube, row_dims, row_entries)
+
+        if col_dims:
+            col_entries = _blocks(col_codes, subtotals)
+            grids = [_block_sums(grid, col_entries, axis=1) for grid in grids]
+            columns = _axis_index(cube, col_dims, col_entries)
+        else:
+            columns = pd.Index([metric])
+
+        grid_counts, grid_approvals, grid_sums = grids
+        values = _metric(grid_counts, grid_approvals, grid_sums, metric)
+        if metric == "件数":
+            values = values.astype(np.int64)
+        result = pd.DataFrame(values, index=index, columns=columns)
+
+        if percent:
+            if col_dims:
+                # 行方向の構成比（行の 合計 列に対する割合）
+                totals = values[:, -1:]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    shares = np.where(totals > 0, values / totals * 100, 0.0)
+                result = pd.DataFrame(np.round(shares, 2), index=index, columns=columns)
+            else:
+                total = values[-1, 0]
+                result["構成比(%)"] = np.round(values[:, 0] / total * 100, 2) if total else 0.0
+        return result
+
+    if key is None:
+        return _compute()
+    cache_key = (key, state_key, tuple(row_dims), tuple(col_dims), metric, subtotals, percent)
+    return _pivot_cache.get_or_compute(cache_key, _compute)
+
+
+def pivot_export_frame(pv: pd.DataFrame) -> pd.DataFrame:
+    """ダウンロード用に、行項目を列に戻し、複数段の列名を「 / 」でつなぐ"""
+    out = pv.reset_index()
+    if isinstance(pv.columns, pd.MultiIndex):
+        out.columns = [" / ".join(str(v) for v in col if v != "") if isinstance(col, tuple) else col
+                       for col in out.columns]
+    return out
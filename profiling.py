@@ -0,0 +1,183 @@
+"""処理段階ごとの所要時間・メモリの計測（サイドバーでオンにしたときだけ）。
+
+スクリプトの再実行ごとに Profiler を1つ作り、段階（読み込み・突合・区分・絞り込み・
+グラフ・ピボットなど）ごとの経過時間と tracemalloc のピークを記録する。
+tracemalloc はプロセス全体の計測のため、メモリは同時に計測中の他セッションの確保も含む。
+結果はサイドバーに表示し、PROFILE_LOG_PATH の JSONL に1再実行1行で追記する。
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_LOG_PATH = os.environ.get("PROFILE_LOG_PATH", "profile_log.jsonl")
+
+# tracemalloc はプロセス全体で1つのため、計測中のセッション数で開始・停止する
+_tracing_lock = threading.RLock()
+_tracing_users = 0
+
+# 全 Profiler の計測中の段階。ピークの読み取りとリセットは1か所（_sample_peak）で行い、
+# リセット前のピークを全段階に反映するので、同時に計測している他セッションのピークを消さない
+_open_stages = weakref.WeakSet()
+
+# Streamlit はセッションごとに別スレッドでスクリプトを実行する
+_local = threading.local()
+
+# セッション状態に前回の再実行の Profiler を残すキー
+_STATE_KEY = "_profiler"
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users = max(0, _tracing_users - 1)
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def _sample_peak():
+    """前回の読み取りからのピークを計測中の全段階に反映してリセットする（_tracing_lock 内で呼ぶ）"""
+    if not tracemalloc.is_tracing():
+        return
+    peak = tracemalloc.get_traced_memory()[1]
+    for stage in _open_stages:
+        stage.peak = max(stage.peak, peak)
+    tracemalloc.reset_peak()
+
+
+class _Stage:
+    def __init__(self, name: str, tracing: bool):
+        self.name = name
+        self.started = time.perf_counter()
+        self.base = tracemalloc.get_traced_memory()[0] if tracing and tracemalloc.is_tracing() else 0
+        self.peak = self.base
+
+
+class Profiler:
+    """段階ごとの経過時間とメモリのピーク（段階開始時からの増分）を記録する"""
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = True):
+        self.enabled = enabled
+        self.records = []
+        self._stack = []
+        self._lap = None
+        self._started = time.perf_counter()
+        self._tracing = enabled and trace_memory
+        # finish されないまま捨てられた（例外で止まった再実行など）ときも tracemalloc の利用を解除する
+        self._release = weakref.finalize(self, _stop_tracing) if self._tracing else None
+        if self._tracing:
+            _start_tracing()
+
+    def _open(self, name: str) -> _Stage:
+        if self._stack:
+            name = f"{self._stack[-1].name}/{name}"
+        if not self._tracing:
+            stage = _Stage(name, False)
+        else:
+            # それまでのピークを計測中の段階（入れ子の外側・他セッション）へ反映してから始める
+            with _tracing_lock:
+                _sample_peak()
+                stage = _Stage(name, True)
+                _open_stages.add(stage)
+        self._stack.append(stage)
+        return stage
+
+    def _close(self, stage: _Stage):
+        if self._tracing:
+            with _tracing_lock:
+                _sample_peak()
+                _open_stages.discard(stage)
+        self._stack.remove(stage)
+        self.records.append({
+            "stage": stage.name,
+            "seconds": round(time.perf_counter() - stage.started, 4),
+            "peak_bytes": int(stage.peak - stage.base),
+        })
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        stage = self._open(name)
+        try:
+            yield
+        finally:
+            self._close(stage)
+
+    def begin(self, name: str):
+        """前の begin の段階を閉じて、次の段階を始める（with で囲みにくい画面の区切り用）"""
+        if not self.enabled:
+            return
+        self.end()
+        self._lap = self._open(name)
+
+    def end(self):
+        if self._lap is not None:
+            self._close(self._lap)
+            self._lap = None
+
+    @property
+    def total_seconds(self) -> float:
+        return time.perf_counter() - self._started
+
+    def finish(self, log_path: str = PROFILE_LOG_PATH, **info) -> list:
+        """計測を終えて記録を返し、log_path に追記する（info は行数などの付加情報）"""
+        if not self.enabled:
+            return []
+        self.end()
+        while self._stack:
+            self._close(self._stack[-1])
+        if self._release is not None:
+            self._release()
+        self.enabled = False
+        if log_path:
+            entry = {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "total_seconds": round(self.total_seconds, 4),
+                **info,
+                "stages": self.records,
+            }
+            with _tracing_lock, open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        return self.records
+
+
+def start_profiler(enabled: bool, state=None) -> Profiler:
+    """このスレッド（セッションの再実行）の Profiler を作る。前回の計測が閉じられていなければ破棄する
+
+    state（st.session_state）を渡すと、例外や中断で閉じられなかった前回の再実行の計測も閉じる
+    （Streamlit は次の再実行を別スレッドで始めることがあるため）。
+    """
+    previous = [getattr(_local, "profiler", None)]
+    if state is not None:
+        previous.append(state.get(_STATE_KEY))
+    for profiler in previous:
+        if profiler is not None and profiler.enabled:
+            profiler.finish(log_path=None)
+    _local.profiler = Profiler(enabled)
+    if state is not None:
+        state[_STATE_KEY] = _local.profiler
+    return _local.profiler
+
+
+def current_profiler() -> Profiler:
+    profiler = getattr(_local, "profiler", None)
+    return profiler if profiler is not None else Profiler(enabled=False)
+
+
+def stage(name: str):
+    """現在の Profiler の段階（計測していなければ何もしない）"""
+    return current_profiler().stage(name)
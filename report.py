@@ -0,0 +1,212 @@
+"""グラフのPowerPoint/PNG一括出力（Streamlit を使わないバッチ実行）。
+
+アップロード用と同じExcelを読み込み、カテゴリ×申込月などの絞り込みの組み合わせごとに
+chart_cols のグラフを並べた PPTX を1ファイルずつ作る。整形済みデータは一時Parquetに
+書き出してワーカープロセスで読み直し、各ワーカーは担当分のグラフ画像を
+kaleido でまとめて書き出す（Chrome の起動はワーカーごとに1回だけ）。
+
+使い方:
+    python report.py 後方数値.xlsx --by カテゴリ --monthly --out reports
+"""
+import argparse
+import calendar
+import itertools
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly.io as pio
+from pptx import Presentation
+from pptx.util import Inches, Pt
+
+from aggregate import AggregationCube, chart_cols
+from binning import add_bin_columns
+from charts import chart_figures
+from filters import FilterEngine, filter_cols
+from ingest import load_uploaded_workbooks
+from master import attach_master, load_master_index
+from store import UNKNOWN_MONTH, month_keys, parquet_safe
+
+DEFAULT_MASTER_PATH = "媒体コードマスタ.xlsx"
+
+# スライド（16:9）と画像の大きさ
+SLIDE_WIDTH = Inches(13.333)
+SLIDE_HEIGHT = Inches(7.5)
+IMAGE_WIDTH = 1600
+IMAGE_HEIGHT = 900
+
+# ワーカープロセスごとの FilterEngine / AggregationCube
+_worker = {}
+
+
+def load_workbooks(paths: list, master_path: str = DEFAULT_MASTER_PATH) -> pd.DataFrame:
+    """Excelを読み込んで整形し、マスタ引き当てと区分列の追加まで行う"""
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+    result = load_uploaded_workbooks(files)
+    for name, reason in result.skipped.items():
+        print(f"{name}: {reason}", file=sys.stderr)
+    if result.df is None:
+        raise ValueError("読み込めるExcelファイルがありません")
+    return add_bin_columns(attach_master(result.df, load_master_index(master_path)))
+
+
+def month_range(month: str):
+    """'YYYY-MM' の初日と末日"""
+    start = pd.Timestamp(f"{month}-01").date()
+    return start, start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+
+def _combination_mask(engine: FilterEngine, combo: dict):
+    masks = [engine.isin_mask(col, [value]) for col, value in combo.items() if col != "申込月"]
+    if "申込月" in combo:
+        masks.append(engine.date_mask(*month_range(combo["申込月"])))
+    return engine.combine(masks)
+
+
+def list_combinations(df: pd.DataFrame, by: list, monthly: bool) -> list:
+    """データに現れる絞り込みの組み合わせ（{列: 値}）と件数"""
+    engine = FilterEngine(df)
+    axes = []
+    for col in by:
+        if not engine.has_filter(col):
+            raise ValueError(f"列「{col}」がデータにありません")
+        axes.append([(col, value) for value in engine.options(col, engine.combine([]))])
+    if monthly:
+        months = sorted(set(month_keys(df).unique()) - {UNKNOWN_MONTH})
+        axes.append([("申込月", month) for month in months])
+
+    combos = []
+    for items in itertools.product(*axes):
+        combo = dict(items)
+        n_rows = int(_combination_mask(engine, combo).sum())
+        if n_rows:
+            combos.append((combo, n_rows))
+    return combos
+
+
+def combination_label(combo: dict) -> str:
+    return " / ".join(str(value) for value in combo.values()) or "全件"
+
+
+def file_stem(combo: dict) -> str:
+    # ファイル名に使えない文字と空白を置き換える
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", "_".join(str(value) for value in combo.values()) or "全件")
+
+
+def _init_worker(parquet_path: str):
+    df = pd.read_parquet(parquet_path)
+    engine = FilterEngine(df)
+    _worker["engine"] = engine
+    _worker["cube"] = AggregationCube(df, [col for _, col in chart_cols])
+
+
+def build_deck(combo: dict, n_rows: int, images: list, path: str):
+    """タイトルスライドとグラフ1枚ずつのスライドからなる PPTX を保存する"""
+    prs = Presentation()
+    prs.slide_width = SLIDE_WIDTH
+    prs.slide_height = SLIDE_HEIGHT
+
+    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    slide.shapes.title.text = combination_label(combo)
+    slide.placeholders[1].text = f"{n_rows:,}件"
+
+    blank = prs.slide_layouts[6]
+    for title, image in images:
+        slide = prs.slides.add_slide(blank)
+        box = slide.shapes.add_textbox(Inches(0.4), Inches(0.2), SLIDE_WIDTH - Inches(0.8), Inches(0.5))
+        box.text_frame.text = f"{combination_label(combo)}：{title}"
+        box.text_frame.paragraphs[0].runs[0].font.size = Pt(18)
+        slide.shapes.add_picture(image, Inches(0.4), Inches(0.8), height=SLIDE_HEIGHT - Inches(1.0))
+    prs.save(path)
+
+
+def render_chunk(chunk: list, out_dir: str, png_dir: str, width: int, height: int) -> list:
+    """担当する組み合わせのグラフを作り、画像をまとめて書き出してから PPTX を作る"""
+    engine, cube = _worker["engine"], _worker["cube"]
+    plans = []
+    figs, image_paths = [], []
+    for combo, n_rows in chunk:
+        stem = file_stem(combo)
+        images = []
+        mask = _combination_mask(engine, combo)
+        for i, (title, _, fig) in enumerate(chart_figures(cube, mask), start=1):
+            image_path = os.path.join(png_dir, f"{stem}_{i:02d}.png")
+            figs.append(fig)
+            image_paths.append(image_path)
+            images.append((title, image_path))
+        plans.append((combo, n_rows, stem, images))
+
+    # kaleido はまとめて渡すと1つのブラウザで順に書き出す
+    if figs:
+        pio.write_images(figs, image_paths, width=width, height=height)
+
+    decks = []
+    for combo, n_rows, stem, images in plans:
+        path = os.path.join(out_dir, f"{stem}.pptx")
+        build_deck(combo, n_rows, images, path)
+        decks.append(path)
+    return decks
+
+
+def generate_reports(df: pd.DataFrame, by: list, monthly: bool, out_dir: str, workers: int = None,
+                     png_dir: str = None, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT) -> list:
+    """組み合わせごとの PPTX をプロセスプールで作り、出力したファイルの一覧を返す
+
+    png_dir を省略するとグラフ画像は一時ディレクトリに書き出して最後に消す。
+    """
+    combos = list_combinations(df, by, monthly)
+    if not combos:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(combos)))
+    # 件数の多い組み合わせから順に配り、ワーカー間の負荷を揃える
+    combos.sort(key=lambda item: -item[1])
+    chunks = [combos[i::workers] for i in range(workers)]
+
+    decks = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        parquet_path = os.path.join(tmp_dir, "data.parquet")
+        parquet_safe(df).to_parquet(parquet_path, index=False)
+        if png_dir is None:
+            png_dir = tmp_dir
+        os.makedirs(png_dir, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(parquet_path,)) as pool:
+            futures = [pool.submit(render_chunk, chunk, out_dir, png_dir, width, height) for chunk in chunks]
+            for future in as_completed(futures):
+                decks.extend(future.result())
+    return sorted(decks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="絞り込みの組み合わせごとにグラフのPowerPointを作成します")
+    parser.add_argument("workbooks", nargs="+", help="後方数値データのExcelファイル")
+    parser.add_argument("--by", nargs="*", default=["カテゴリ"], choices=filter_cols,
+                        help="組み合わせを作る列（既定: カテゴリ）")
+    parser.add_argument("--monthly", action="store_true", help="申込月ごとにも分ける")
+    parser.add_argument("--master", default=DEFAULT_MASTER_PATH, help="媒体コードマスタのExcelファイル")
+    parser.add_argument("--out", default="reports", help="PPTX の出力先ディレクトリ")
+    parser.add_argument("--png-dir", default=None, help="グラフ画像（PNG）も残す場合の出力先ディレクトリ")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（既定: CPU数）")
+    parser.add_argument("--width", type=int, default=IMAGE_WIDTH, help="画像の幅（px）")
+    parser.add_argument("--height", type=int, default=IMAGE_HEIGHT, help="画像の高さ（px）")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    df = load_workbooks(args.workbooks, args.master)
+    decks = generate_reports(df, args.by, args.monthly, args.out, args.workers,
+                             args.png_dir, args.width, args.height)
+    for path in decks:
+        print(path)
+    print(f"{len(decks)}件のPowerPointを作成しました（{time.perf_counter() - started:.1f}秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
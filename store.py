@@ -0,0 +1,150 @@
+"""整形済みデータのローカル保存（Parquet・申込月ごとに分割）。
+
+アップロードされたExcelは整形後に data_store/<データセットID>/<申込月>.parquet として保存し、
+catalog.json に一覧を残す。次回からはExcelを再アップロードせずに、
+保存済みの月を選んで列を絞って読み込める。
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from cache import LRUCache
+from ingest import apply_dtype_plan, dashboard_cols
+
+DATA_STORE_DIR = os.environ.get("DATA_STORE_DIR", "data_store")
+CATALOG_FILE = "catalog.json"
+
+# 申込日が無い/不正な行の分割名
+UNKNOWN_MONTH = "unknown"
+
+_store_cache = LRUCache(max_entries=4, max_bytes=2 * 1024 ** 3, name="store")
+
+
+def _catalog_path(store_dir: str) -> str:
+    return os.path.join(store_dir, CATALOG_FILE)
+
+
+def _partition_path(store_dir: str, dataset_id: str, month: str) -> str:
+    return os.path.join(store_dir, dataset_id, f"{month}.parquet")
+
+
+def load_catalog(store_dir: str = DATA_STORE_DIR) -> dict:
+    """保存済みデータセットの一覧（データセットID → 情報）"""
+    path = _catalog_path(store_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_catalog(catalog: dict, store_dir: str):
+    # 書き込み途中のファイルを読まれないよう一時ファイルから置き換える
+    path = _catalog_path(store_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _mixed_object(values) -> bool:
+    return values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty")
+
+
+def parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """型が混在する object 列・カテゴリ列（数値と文字列の混在など）を文字列に揃える"""
+    out = df
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            if not _mixed_object(s.cat.categories):
+                continue
+            labels = s.cat.categories.astype(str)
+            # 12345 と '12345' のように文字列にすると重なるカテゴリがあれば値から作り直す
+            safe = s.cat.rename_categories(labels) if labels.is_unique \
+                else s.astype(str).where(s.notna()).astype("category")
+        elif _mixed_object(s):
+            safe = s.where(s.isna(), s.astype(str))
+        else:
+            continue
+        if out is df:
+            out = df.copy()
+        out[col] = safe
+    return out
+
+
+def month_keys(df: pd.DataFrame) -> pd.Series:
+    """行ごとの申込月（'YYYY-MM'、不明は UNKNOWN_MONTH）"""
+    if '申込日' not in df.columns:
+        return pd.Series(UNKNOWN_MONTH, index=df.index)
+    return df['申込日'].dt.strftime("%Y-%m").fillna(UNKNOWN_MONTH)
+
+
+def save_dataset(df: pd.DataFrame, dataset_id: str, name: str, store_dir: str = DATA_STORE_DIR) -> dict:
+    """整形済みデータを申込月ごとに保存し、カタログ情報を返す（保存済みなら何もしない）"""
+    catalog = load_catalog(store_dir)
+    if dataset_id in catalog:
+        return catalog[dataset_id]
+
+    os.makedirs(os.path.join(store_dir, dataset_id), exist_ok=True)
+    safe_df = parquet_safe(df)
+    months = {}
+    for month, part in safe_df.groupby(month_keys(safe_df), sort=True):
+        # 同じデータを同時に保存する別セッションに書き込み途中のファイルを読まれないよう、
+        # 一時ファイルに書いてから置き換える
+        path = _partition_path(store_dir, dataset_id, month)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            part.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        months[month] = len(part)
+
+    entry = {
+        "name": name,
+        "saved_at": datetime.now().isoformat(timespec="seconds"),
+        "rows": len(df),
+        "columns": [str(c) for c in df.columns],
+        "months": months,
+    }
+    # 他セッションの保存と競合しないよう、書き込み直前に読み直す
+    catalog = load_catalog(store_dir)
+    catalog[dataset_id] = entry
+    _write_catalog(catalog, store_dir)
+    return entry
+
+
+def load_months(selection: list, columns: list = None, store_dir: str = DATA_STORE_DIR) -> pd.DataFrame:
+    """保存済みの (データセットID, 申込月) を読み込んで結合する（ファイルの無い月は飛ばす）
+
+    columns を省略するとダッシュボードで参照する列（dashboard_cols）だけを読む。
+    返り値はセッション間で共有されるため、呼び出し側で直接変更しないこと。
+    """
+    columns = dashboard_cols if columns is None else columns
+    catalog = load_catalog(store_dir)
+    paths = []
+    for dataset_id, month in selection:
+        entry = catalog.get(dataset_id)
+        if entry is None or month not in entry["months"]:
+            continue
+        cols = [c for c in columns if c in entry["columns"]]
+        path = _partition_path(store_dir, dataset_id, month)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            # カタログにあってもファイルが消えている月は読まない
+            continue
+        paths.append((path, mtime, tuple(cols)))
+
+    def _read():
+        frames = [pd.read_parquet(path, columns=list(cols), memory_map=True) for path, _, cols in paths]
+        if not frames:
+            return pd.DataFrame(columns=list(columns))
+        # 分割ごとにカテゴリが異なると結合で object に戻るため、型を付け直す
+        return apply_dtype_plan(pd.concat(frames, ignore_index=True))
+
+    return _store_cache.get_or_compute(tuple(paths), _read)
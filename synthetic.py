@@ -0,0 +1,137 @@
+"""ベンチマーク・動作確認用の合成後方数値データ。
+
+実データと同じ列構成（申込日・媒体コード・'xxx_男性' 形式の性別・年収などの数値列・
+取扱金額の内訳列）で、媒体コードは媒体コードマスタから引く。値の分布は
+実データの傾向に近づけた目安で、集計結果そのものに意味はない。
+
+使い方:
+    python synthetic.py 100000 --out synthetic_100k.xlsx
+"""
+import argparse
+import io
+
+import numpy as np
+import pandas as pd
+
+from master import build_master_index, read_master
+
+DEFAULT_MASTER_PATH = "媒体コードマスタ.xlsx"
+
+# Excel の1シートに入る最大行数（見出し行を除く）
+EXCEL_MAX_ROWS = 1_048_575
+
+prefectures = [
+    "東京都", "神奈川県", "大阪府", "愛知県", "埼玉県", "千葉県", "兵庫県", "北海道", "福岡県", "静岡県",
+    "茨城県", "広島県", "京都府", "宮城県", "新潟県", "長野県", "岐阜県", "群馬県", "栃木県", "岡山県",
+    "福島県", "三重県", "熊本県", "鹿児島県", "沖縄県", "滋賀県", "山口県", "愛媛県", "奈良県", "長崎県",
+    "青森県", "岩手県", "大分県", "石川県", "山形県", "宮崎県", "富山県", "秋田県", "香川県", "和歌山県",
+    "佐賀県", "山梨県", "福井県", "徳島県", "高知県", "島根県", "鳥取県",
+]
+purposes = ["生活費", "教育費", "医療費", "旅行", "冠婚葬祭", "借換え", "事業資金", "その他"]
+family_types = ["独身", "既婚", "既婚（子あり）", "その他"]
+employment_types = ["正社員", "契約社員", "派遣社員", "パート・アルバイト", "自営業", "公務員", "無職"]
+
+
+def master_codes(master_path: str = DEFAULT_MASTER_PATH) -> list:
+    """媒体コードマスタに登録されている媒体コード"""
+    return build_master_index(read_master(master_path)).lookup.index.astype(str).tolist()
+
+
+def _zipf_weights(n: int, a: float = 1.1) -> np.ndarray:
+    # 一部の媒体・地域に申込が偏る分布
+    weights = 1.0 / np.arange(1, n + 1) ** a
+    return weights / weights.sum()
+
+
+def make_frame(n_rows: int, codes: list, start: str = "2025-01-01", months: int = 12,
+               seed: int = 0) -> pd.DataFrame:
+    """アップロードExcelと同じ列構成の合成データ（整形前）"""
+    rng = np.random.default_rng(seed)
+    n = n_rows
+
+    start_ts = pd.Timestamp(start)
+    days = (start_ts + pd.DateOffset(months=months) - start_ts).days
+    applied = start_ts + pd.to_timedelta(rng.integers(0, days, n), unit="D")
+
+    # マスタに無いコード（未登録媒体）も少し混ぜる
+    code_pool = np.array(list(codes) + ["UNKNOWN01"], dtype=object)
+    media = code_pool[rng.choice(len(code_pool), n, p=_zipf_weights(len(code_pool)))]
+
+    gender = rng.choice(np.array(["01_男性", "02_女性", None], dtype=object), n, p=[0.58, 0.40, 0.02])
+    age = np.clip(rng.normal(41, 12, n), 18, 85).round()
+    income = np.clip(rng.lognormal(np.log(380), 0.55, n), 0, 5000).round()
+    desired = rng.choice(np.array([0, 5, 10, 20, 30, 50, 80, 100, 150, 200, 300, 500]), n,
+                         p=[0.05, 0.08, 0.17, 0.14, 0.12, 0.15, 0.06, 0.1, 0.04, 0.05, 0.03, 0.01])
+    housing = np.where(rng.random(n) < 0.65, 0, np.clip(rng.lognormal(np.log(8), 0.5, n), 1, 150).round(1))
+    tenure = np.clip(rng.exponential(8, n), 0, 45).round(1)
+    other_loans = np.minimum(rng.poisson(0.9, n), 9)
+    children = np.minimum(rng.poisson(0.8, n), 6)
+
+    # 年収が高く他社借入が少ないほど承認されやすい
+    score = 0.35 + 0.25 * np.tanh((income - 350) / 300) - 0.07 * other_loans
+    decided = rng.random(n) < 0.93
+    approved = rng.random(n) < np.clip(score, 0.02, 0.95)
+    status = np.where(~decided, None, np.where(approved, "承認", "否決")).astype(object)
+
+    def amounts(p_use, scale):
+        # 承認された申込の一部だけ取扱が発生する（円、千円単位）
+        used = approved & decided & (rng.random(n) < p_use)
+        values = np.where(used, (rng.lognormal(np.log(scale), 0.8, n) / 1000).round() * 1000, 0.0)
+        values[rng.random(n) < 0.01] = np.nan
+        return values
+
+    df = pd.DataFrame({
+        "申込番号": np.arange(1, n + 1, dtype=np.int64) + seed * 10_000_000_000,
+        "申込日": applied,
+        "媒体コード": media,
+        "性別": gender,
+        "年齢": age,
+        "年収": income,
+        "同借希望額": desired,
+        "住宅ローン返済月額": housing,
+        "勤続年数": tenure,
+        "他社借入件数": other_loans,
+        "都道府県": np.array(prefectures, dtype=object)[rng.choice(len(prefectures), n, p=_zipf_weights(len(prefectures), 0.8))],
+        "利用目的": rng.choice(np.array(purposes, dtype=object), n),
+        "家族構成": rng.choice(np.array(family_types, dtype=object), n, p=[0.38, 0.22, 0.34, 0.06]),
+        "子供数": children,
+        "勤務状況": rng.choice(np.array(employment_types, dtype=object), n, p=[0.5, 0.1, 0.06, 0.16, 0.08, 0.07, 0.03]),
+        "承認区分": status,
+        "取扱金額_申込当月": amounts(0.6, 80_000),
+        "取扱金額_申込翌月末": amounts(0.4, 50_000),
+        "取扱金額_申込翌々月末": amounts(0.3, 40_000),
+    })
+    # 欠損（未入力）を少し混ぜる
+    for col in ["年収", "勤続年数", "利用目的"]:
+        df.loc[rng.random(n) < 0.01, col] = None
+    return df
+
+
+def workbook_bytes(df: pd.DataFrame) -> bytes:
+    """DataFrame をアップロード用と同じ形式の xlsx バイト列にする"""
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(f"Excel の1シートに入るのは {EXCEL_MAX_ROWS:,} 行までです")
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成の後方数値データ（Excel）を作成します")
+    parser.add_argument("rows", type=int, help="行数")
+    parser.add_argument("--out", default=None, help="出力ファイル（既定: synthetic_<行数>.xlsx）")
+    parser.add_argument("--master", default=DEFAULT_MASTER_PATH, help="媒体コードマスタのExcelファイル")
+    parser.add_argument("--start", default="2025-01-01", help="申込日の開始日")
+    parser.add_argument("--months", type=int, default=12, help="申込日の期間（月数）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    args = parser.parse_args(argv)
+
+    df = make_frame(args.rows, master_codes(args.master), args.start, args.months, args.seed)
+    out = args.out or f"synthetic_{args.rows}.xlsx"
+    with open(out, "wb") as f:
+        f.write(workbook_bytes(df))
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
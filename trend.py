@@ -0,0 +1,175 @@
+"""申込日の時系列トレンド（日次ロールアップからの日・週・月次集計）。
+
+データセットごとに 日 × 媒体名 × カテゴリ の 件数・承認件数・取扱高 を一度だけ集計しておき
+（DailyRollup）、期間・集計単位・内訳を変えたときはこの小さな表だけを集計し直す。
+移動平均と前期差・前期比は集計後の系列から求める。
+"""
+import numpy as np
+import pandas as pd
+
+from aggregate import APPROVED_LABEL
+from binning import UNKNOWN_LABEL
+from cache import LRUCache
+
+# 表示名 -> 集計単位
+trend_freqs = {"日": "D", "週": "W", "月": "M"}
+
+trend_metrics = ["件数", "承認件数", "取扱高", "承認率(%)"]
+
+# 内訳の線が多くなりすぎないよう、件数上位だけ表示して残りは OTHER_LABEL にまとめる
+TREND_TOP_N = 10
+OTHER_LABEL = "その他"
+
+_rollup_cache = LRUCache(max_entries=4, max_bytes=1024 ** 3, name="rollup")
+
+
+class DailyRollup:
+    """日 × dims ごとの 件数・承認件数・取扱高（申込日が欠損の行は含まない）"""
+
+    def __init__(self, df: pd.DataFrame, dims: tuple = ("媒体名", "カテゴリ"), value_col: str = "取扱高",
+                 approval_col: str = "承認区分"):
+        self.dims = [dim for dim in dims if dim in df.columns]
+        if '申込日' in df.columns:
+            dates = df['申込日'].to_numpy(dtype="datetime64[D]")
+            days, valid = dates.astype(np.int64), ~np.isnat(dates)
+        else:
+            days = np.zeros(len(df), dtype=np.int64)
+            valid = np.zeros(len(df), dtype=bool)
+
+        self._labels = {}
+        codes = []
+        for dim in self.dims:
+            s = df[dim]
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                dim_codes, labels = s.cat.codes.to_numpy(), s.cat.categories
+            else:
+                dim_codes, labels = pd.factorize(s, sort=True)
+            # 欠損（-1）は末尾のコードにする
+            self._labels[dim] = pd.Index(labels).astype(object).append(pd.Index([np.nan], dtype=object))
+            codes.append(np.where(dim_codes < 0, len(labels), dim_codes).astype(np.int64))
+
+        values = pd.to_numeric(df[value_col], errors="coerce").fillna(0).to_numpy(dtype="float64") \
+            if value_col in df.columns else np.zeros(len(df))
+        approved = (df[approval_col] == APPROVED_LABEL).to_numpy(dtype=bool, na_value=False) \
+            if approval_col in df.columns else np.zeros(len(df), dtype=bool)
+
+        # 日を最上位桁にした組み合わせキーで集計するので、結果は日付順に並ぶ
+        day0 = int(days[valid].min()) if valid.any() else 0
+        combined = days[valid] - day0
+        for dim, dim_codes in zip(self.dims, codes):
+            combined = combined * len(self._labels[dim]) + dim_codes[valid]
+        keys, inverse = np.unique(combined, return_inverse=True)
+        self.counts = np.bincount(inverse, minlength=len(keys))
+        self.approvals = np.bincount(inverse[approved[valid]], minlength=len(keys))
+        self.sums = np.bincount(inverse, weights=values[valid], minlength=len(keys))
+
+        self._codes = {}
+        for dim in reversed(self.dims):
+            size = len(self._labels[dim])
+            self._codes[dim] = (keys % size).astype(np.int32)
+            keys = keys // size
+        self.day = keys + day0  # 1970-01-01 からの日数
+        # 週（月曜始まり、1970-01-01 は木曜）と月の通し番号
+        self._week = (self.day + 3) // 7
+        self._month = self.day.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.day, self.counts, self.approvals, self.sums, self._week, self._month]
+        return sum(a.nbytes for a in arrays) + sum(c.nbytes for c in self._codes.values())
+
+    def _period(self, freq: str, rows: slice):
+        """行ごとの期間番号と、期間番号 -> 期間の初日"""
+        if freq == "W":
+            return self._week[rows], lambda p: (p * 7 - 3).astype("datetime64[D]")
+        if freq == "M":
+            return self._month[rows], lambda p: p.astype("datetime64[M]").astype("datetime64[D]")
+        return self.day[rows], lambda p: p.astype("datetime64[D]")
+
+    def series(self, start_date, end_date, freq: str = "D", by: str = None, selections: dict = None,
+               top_n: int = TREND_TOP_N) -> pd.DataFrame:
+        """start_date〜end_date の期間ごと（by があれば値ごと）の 件数・承認件数・取扱高・承認率(%)
+
+        selections は {列: 値のリスト} の絞り込み。期間内に申込の無い期間も 0 の行として含める。
+        """
+        lo = np.searchsorted(self.day, np.datetime64(start_date, "D").astype(np.int64), side="left")
+        hi = np.searchsorted(self.day, np.datetime64(end_date, "D").astype(np.int64), side="right")
+        rows = slice(lo, hi)
+        keep = np.ones(hi - lo, dtype=bool)
+        for col, values in (selections or {}).items():
+            labels = self._labels[col]
+            positions = labels.get_indexer(list(values))
+            table = np.zeros(len(labels), dtype=bool)
+            table[positions[positions >= 0]] = True
+            keep &= table[self._codes[col][rows]]
+
+        periods, to_date = self._period(freq, rows)
+        periods = periods[keep]
+        columns = ["期間"] + ([by] if by else []) + ["件数", "承認件数", "取扱高", "承認率(%)"]
+        if len(periods) == 0:
+            return pd.DataFrame(columns=columns)
+        counts, approvals, sums = self.counts[rows][keep], self.approvals[rows][keep], self.sums[rows][keep]
+
+        if by:
+            group = self._codes[by][rows][keep]
+            labels = self._labels[by]
+            totals = np.bincount(group, weights=counts, minlength=len(labels))
+            present = np.flatnonzero(totals)
+            top = present[np.argsort(-totals[present], kind="stable")][:top_n]
+            # 上位の値（値の昇順）と その他
+            top = np.sort(top)
+            remap = np.full(len(labels), len(top), dtype=np.int64)
+            remap[top] = np.arange(len(top))
+            group = remap[group]
+            # 欠損は「不明」として表示する
+            group_labels = [UNKNOWN_LABEL if pd.isna(label) else label for label in labels[top]]
+            if len(present) > len(top):
+                group_labels.append(OTHER_LABEL)
+            n_groups = len(group_labels)
+        else:
+            group = np.zeros(len(periods), dtype=np.int64)
+            group_labels, n_groups = [None], 1
+
+        # 期間 × 値 の全組み合わせで集計（申込の無い期間も 0 で残す）
+        first = periods.min()
+        n_periods = int(periods.max() - first + 1)
+        key = (periods - first) * n_groups + group
+        size = n_periods * n_groups
+        grid_counts = np.bincount(key, weights=counts, minlength=size)
+        grid_approvals = np.bincount(key, weights=approvals, minlength=size)
+        grid_sums = np.bincount(key, weights=sums, minlength=size)
+
+        period_ids = np.repeat(np.arange(n_periods) + first, n_groups)
+        result = {"期間": to_date(period_ids).astype("datetime64[ns]")}
+        if by:
+            result[by] = np.tile(np.array(group_labels, dtype=object), n_periods)
+        result["件数"] = grid_counts.astype(np.int64)
+        result["承認件数"] = grid_approvals.astype(np.int64)
+        result["取扱高"] = grid_sums
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result["承認率(%)"] = np.round(np.where(grid_counts > 0, grid_approvals / grid_counts * 100, np.nan), 2)
+        return pd.DataFrame(result, columns=columns)
+
+
+def add_trend_columns(series: pd.DataFrame, metric: str, window: int = 0, by: str = None) -> pd.DataFrame:
+    """metric の移動平均（window 期間、0 なら付けない）と前期差・前期比(%) の列を加える"""
+    series = series.copy()
+    grouped = series.groupby(by, sort=False, dropna=False)[metric] if by else series[metric]
+    if window and window > 1:
+        moving = grouped.rolling(window, min_periods=1).mean()
+        if by:
+            moving = moving.reset_index(level=0, drop=True)
+        series[f"{metric}（{window}期間移動平均）"] = moving.round(2)
+    previous = grouped.shift(1)
+    series["前期差"] = (series[metric] - previous).round(2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        series["前期比(%)"] = ((series[metric] / previous.replace(0, np.nan) - 1) * 100).round(2)
+    return series
+
+
+def load_rollup(key, df: pd.DataFrame) -> DailyRollup:
+    """key（データセット・マスタの組）ごとに DailyRollup を作って使い回す"""
+    return _rollup_cache.get_or_compute(key, lambda: DailyRollup(df))